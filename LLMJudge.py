@@ -1,7 +1,9 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import openai
 
+from cache import DiskCache, make_key
 from config import Config
 
 MARKER_SYSTEM_PROMPT = """
@@ -265,11 +267,31 @@ Please evaluate the following model response:
 """
 
 
+class SubJudgementError(Exception):
+    """
+    Raised when sub-judgements of a response failed.
+
+    :param results: Results of the sub-judgements that succeeded, by judge type.
+    :param errors: Errors of the failed sub-judgements, by judge type.
+    """
+
+    def __init__(self, results: dict[str, dict], errors: dict[str, Exception]):
+        super().__init__(", ".join(f"{judge_type} judgement failed: {error}" for judge_type, error in errors.items()))
+        self.results = results
+        self.errors = errors
+
+
 class LLMJudge:
-    def __init__(self, model: str = "gpt-4o-mini-2024-07-18", temperature: float = 0):
+    SUB_JUDGEMENTS = ("marker", "definitions")
+
+    def __init__(self, model: str = "gpt-4o-mini-2024-07-18", temperature: float = 0, max_workers: int = 16,
+                 cache: DiskCache | None = None):
         self.client = openai.OpenAI(api_key=Config.CREDENTIALS.openai_api_key)
         self.model = model
         self.temperature = temperature
+        self.cache = cache
+        # Shared by all judge_response calls, so size it to twice the number of concurrent callers.
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
 
     def sub_judge_response(self, query: str, model_response: str, judge_type: str, response_style: str) -> dict:
         if judge_type == "marker":
@@ -282,9 +304,16 @@ class LLMJudge:
             )
             schema = DEFINITION_SCHEMA
 
+        user_prompt = JUDGE_PROMPT_TEMPLATE.format(query=query, model_response=model_response)
+        cache_key = make_key(self.model, system_prompt, schema, user_prompt)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
         messages = [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": JUDGE_PROMPT_TEMPLATE.format(query=query, model_response=model_response)},
+            {"role": "user", "content": user_prompt},
         ]
 
         response = self.client.responses.create(
@@ -294,12 +323,38 @@ class LLMJudge:
             text=schema,
         )
 
-        return json.loads(response.output_text)
+        result = json.loads(response.output_text)
+        if self.cache is not None:
+            self.cache.set(cache_key, result)
+        return result
+
+    def judge_response(self, query: str, model_response: str, response_style: str,
+                       sub_results: dict[str, dict] | None = None) -> dict:
+        """
+        Run the marker and definitions sub-judgements concurrently and combine them.
+
+        :param sub_results: Results of sub-judgements that already succeeded, e.g. of a SubJudgementError,
+                            only the missing sub-judgements are run.
+        :raises SubJudgementError: If a sub-judgement failed, with the results of the ones that succeeded.
+        """
+        sub_results = dict(sub_results or {})
+        futures = {
+            judge_type: self.executor.submit(self.sub_judge_response, query, model_response, judge_type,
+                                             response_style)
+            for judge_type in self.SUB_JUDGEMENTS if judge_type not in sub_results
+        }
 
-    def judge_response(self, query: str, model_response: str, response_style: str) -> dict:
-        marker_result = self.sub_judge_response(query, model_response, "marker", response_style)
-        definition_result =self.sub_judge_response(query, model_response, "definitions", response_style)
-        return self.combine_judgments(marker_result, definition_result)
+        errors = {}
+        for judge_type, future in futures.items():
+            try:
+                sub_results[judge_type] = future.result()
+            except Exception as e:
+                print(f"Error with {judge_type} judgement of {self.model}: {e}")
+                errors[judge_type] = e
+        if errors:
+            raise SubJudgementError(sub_results, errors)
+
+        return self.combine_judgments(sub_results["marker"], sub_results["definitions"])
 
     @staticmethod
     def combine_judgments(marker_result, definition_result):
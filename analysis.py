@@ -1,10 +1,10 @@
 import itertools
 from collections import defaultdict, Counter
-from typing import List, Dict, Any, Optional
+from functools import cached_property
+from typing import List, Dict, Any
 
 import numpy as np
 import pandas as pd
-import textstat
 from datasets import load_dataset
 from scipy.stats import friedmanchisquare, kruskal
 from statsmodels.stats.anova import AnovaRM
@@ -26,17 +26,15 @@ from latex.create_hown_table import generate_hown_overview_table
 from latex.create_mulit_lang_table import generate_multi_lang_table
 from latex.create_multi_lang_avg_def_table import generate_multi_lang_avg_def_table
 from latex.create_multi_lang_readability import generate_multi_lang_readability_table
+from metric_engine import analyze_cells
 from reader import JSONLineReader
+from results_store import ResultsStore
 
 
 def nested_dict():
     return defaultdict(nested_dict)
 
 
-def to_dict(d):
-    return {k: to_dict(v) for k, v in d.items()} if isinstance(d, defaultdict) else d
-
-
 def diff_entry(ctx_val, base_val):
     return (ctx_val, ctx_val - base_val) if ctx_val is not None and base_val is not None else (ctx_val, None)
 
@@ -52,16 +50,36 @@ class Analysis:
         'Llama 4 Maverick': 'llama4-maverick-instruct-basic',
         'DeepSeek v3': 'deepseek-v3',
     }
+    # Keys of the parsed results used by the analyses, all others are dropped when reading.
+    RESULT_FIELDS = ('word', 'model_response', 'category', 'complete_marker', 'definitions',
+                     'coarse_synsets_covered', 'wordnet_rankings', 'avg_google_ngrams_frequency')
+    HOWN_FILE = 'batches/homonymy-high-freq/{model}/homonymy-high-freq-{model}-output-judge-{type}{context}_en-parsed-raw.jsonl'
+
+    def __init__(self, results_store: ResultsStore | None = None):
+        # Results are read from the columnar store once it is built, otherwise from the jsonl files.
+        self.results_store = results_store or ResultsStore()
+
+    @cached_property
+    def use_store(self) -> bool:
+        """Whether the results store exists and is up to date with the parsed jsonl files."""
+        if not self.results_store.exists():
+            return False
+        stale_files = self.results_store.stale_files()
+        if stale_files:
+            print(f"Results store is behind {len(stale_files)} parsed files (e.g. {stale_files[0]}), "
+                  f"reading the jsonl files instead. Run results_store.py to refresh it.")
+            return False
+        return True
 
     def filter_hown_valid_words(self, stats):
         all_data = [
-            {**result, 'prompt_type': prompt, 'model': model}
+            (result['word'], prompt, model)
             for prompt in stats.keys()
             for model in self.MODELS
             for result in stats[prompt][model]
         ]
 
-        df = pd.DataFrame(all_data)
+        df = pd.DataFrame(all_data, columns=['word', 'prompt_type', 'model'])
         df['combo'] = df['prompt_type'] + ' | ' + df['model']
         expected = len(stats.keys()) * len(self.MODELS)
         valid_words = set(df.groupby('word')['combo'].nunique()[lambda x: x == expected].index)
@@ -79,7 +97,7 @@ class Analysis:
         reader = JSONLineReader()
         for type_ in self.TYPES:
             stats[type_] = {
-                name: reader.read(base_file.format(model=model_id, type=type_))
+                name: list(reader.iter(base_file.format(model=model_id, type=type_), fields=self.RESULT_FIELDS))
                 for name, model_id in self.MODELS.items()
             }
         return self.filter_hown_valid_words(stats)
@@ -90,13 +108,13 @@ class Analysis:
 
         for lang in self.LANGUAGES:
             all_data = [
-                {**result, 'prompt_type': prompt, 'model': model}
+                (result['word'], prompt, model)
                 for prompt in self.TYPES
                 for model in self.MODELS
                 for result in stats[prompt][lang][model]
             ]
 
-            df = pd.DataFrame(all_data)
+            df = pd.DataFrame(all_data, columns=['word', 'prompt_type', 'model'])
             df['combo'] = df['prompt_type'] + ' | ' + df['model']
             valid_words = set(df.groupby('word')['combo'].nunique()[lambda x: x == expected].index)
 
@@ -119,101 +137,49 @@ class Analysis:
         for type_ in self.TYPES:
             for lang in self.LANGUAGES:
                 stats[type_][lang] = {
-                    name: reader.read(base_file.format(model=model_id, type=type_, lang=lang))
+                    name: list(reader.iter(base_file.format(model=model_id, type=type_, lang=lang),
+                                           fields=self.RESULT_FIELDS))
                     for name, model_id in self.MODELS.items()
                 }
         return self.filter_mcl_valid_words(stats)
 
-    def calculate_completeness(self, results: List[Dict]) -> Dict[str, float]:
-        counter = Counter((item['complete_marker'], item['coarse_synsets_covered'] == 1) for item in results)
-        total = sum(counter.values())
-
-        yes_true = counter.get((True, True), 0)
-        yes_false = counter.get((True, False), 0)
-        no_true = counter.get((False, True), 0)
-        yes_any_true = yes_true + yes_false + no_true
-
-        return {
-            'complete': yes_any_true / total * 100,
-            'both': yes_true / total * 100,
-            'context': (yes_false + yes_true) / total * 100,
-            'full': (no_true + yes_true) / total * 100,
-        }
-
-    def calculate_definition_count(self, results: List[Dict]) -> Dict[str, float]:
-        counts = [len(r['definitions']) for r in results]
-        multi_counts = [c for c in counts if c > 1]
-        return {
-            'avg_definitions': np.mean(counts),
-            'avg_definitions_in_multi': np.mean(multi_counts) if multi_counts else 0,
-        }
+    def check_store_partitions(self, dataset: str, w_context: bool, model_ids: List[str], types: List[str],
+                               languages: List[str]):
+        """Raise a FileNotFoundError like the jsonl files would if any requested partition was never converted."""
+        converted = {(partition['model'], partition['prompt_type'], partition['lang'])
+                     for partition in self.results_store.partitions()
+                     if partition['dataset'] == dataset and partition['context'] == w_context}
+        missing = [f"{model_id}/{type_}/{lang}" for model_id in model_ids for type_ in types for lang in languages
+                   if (model_id, type_, lang) not in converted]
+        if missing:
+            raise FileNotFoundError(f"No results of {dataset}{' with context' if w_context else ''} in the store "
+                                    f"for {len(missing)} model/type/lang: {', '.join(missing)}")
+
+    def read_store_data(self, dataset: str, w_context: bool, languages: List[str]) -> Dict[str, Dict[str, Dict[str, List[Dict]]]]:
+        """Read the results of all TYPES and MODELS as {type: {lang: {model name: results}}} from the store."""
+        model_names = {model_id: name for name, model_id in self.MODELS.items()}
+        self.check_store_partitions(dataset, w_context, list(model_names), self.TYPES, languages)
+        records = self.results_store.read_records(
+            columns=[*self.RESULT_FIELDS, 'model', 'prompt_type', 'lang'],
+            dataset=dataset, context=w_context, model=list(model_names), prompt_type=self.TYPES, lang=languages,
+        )
+
+        stats = {type_: {lang: {name: [] for name in self.MODELS} for lang in languages} for type_ in self.TYPES}
+        for record in records:
+            model, type_, lang = record.pop('model'), record.pop('prompt_type'), record.pop('lang')
+            stats[type_][lang][model_names[model]].append(record)
+        return stats
 
-    def calculate_coarse_synset_coverage(self, results: List[Dict], filter_marker: bool = False) -> Optional[float]:
-        if 'coarse_synsets_covered' not in results[0]:
-            return None
-        values = [
-            item['coarse_synsets_covered']
-            for item in results
-            if not filter_marker or not item['complete_marker']
-        ]
-        return np.mean(values) * 100 if values else None
+    def read_hown_model_results(self, model_id: str, type_: str, w_context: bool = False) -> List[Dict]:
+        if self.use_store:
+            self.check_store_partitions('homonymy-high-freq', w_context, [model_id], [type_], ['en'])
+            return self.results_store.read_records(columns=list(self.RESULT_FIELDS), dataset='homonymy-high-freq',
+                                                   model=model_id, prompt_type=type_, lang='en', context=w_context)
+        file_name = self.HOWN_FILE.format(model=model_id, type=type_, context='_w_context' if w_context else '')
+        return list(JSONLineReader().iter(file_name, fields=self.RESULT_FIELDS))
 
     def analyze_results(self, results: List[Dict], fk_grades: bool = True, lang: str = 'en', reading_score = 'fkgl') -> Dict[str, Any]:
-        total = len(results)
-        num_defs = [r['category'] for r in results]
-        complete_markers = [r['complete_marker'] for r in results]
-        fk_grade = None
-        if fk_grades:
-            if lang in ('en', 'fr', 'ru'):
-                textstat.textstat.set_lang(lang)
-            else:
-                textstat.textstat.set_lang('en')
-
-            if reading_score == 'fkgl':
-                fk_grade = np.mean([textstat.textstat.flesch_kincaid_grade(r['model_response']) for r in results])
-            else:
-                fk_grade = np.mean([textstat.textstat.flesch_reading_ease(r['model_response']) for r in results])
-
-        definition_counts = self.calculate_definition_count(results)
-        coarse_synset_coverage = self.calculate_coarse_synset_coverage(results, filter_marker=False)
-
-        if 'coarse_synsets_covered' in results[0]:
-            counter = Counter((r['category'], r['complete_marker'], r['coarse_synsets_covered'] == 1) for r in results)
-            joint_counter = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-            for (n_defs, context, covered), count in counter.items():
-                joint_counter[n_defs][context][covered] = count
-            completeness = self.calculate_completeness(results)
-            multi_if_marker = sum(joint_counter.get('Multiple', {}).get(True, {}).values())
-            multi_same_def = sum(
-                any(v > 1 for k, v in Counter(r for r in d['wordnet_rankings'] if r != -1).items())
-                for d in results
-            )
-        else:
-            counter = Counter((r['category'], r['complete_marker']) for r in results)
-            joint_counter = defaultdict(lambda: defaultdict(int))
-            for (n_defs, context), count in counter.items():
-                joint_counter[n_defs][context] = count
-            completeness = None
-            multi_same_def = None
-            multi_if_marker = joint_counter.get('Multiple', {}).get(True, 0)
-
-        sense_aware = sum(1 for d in results if d.get('category') == 'Multiple' or d.get('complete_marker') is True)
-        complete_markers_distribution = dict(Counter(complete_markers))
-        category_distribution = dict(Counter(num_defs))
-        return {
-            'total': total,
-            'fk_grade': fk_grade,
-            'definition_counts': definition_counts,
-            'category_distribution': category_distribution,
-            'complete_markers_distribution': complete_markers_distribution,
-            'joint_counter': to_dict(joint_counter),
-            'completeness': completeness,
-            'coarse_synset_coverage': coarse_synset_coverage,
-            'multi_if_marker': multi_if_marker / complete_markers_distribution.get(True) if complete_markers_distribution.get(True) else None,
-            'sense_awareness': sense_aware / total * 100,
-            'more_than_one': category_distribution.get('Multiple',  0) / total * 100,
-            'multi_same_def': multi_same_def / category_distribution.get('Multiple',  0)  * 100 if multi_same_def and category_distribution.get('Multiple') else None,
-        }
+        return analyze_cells({lang: results}, fk_grades=fk_grades, langs={lang: lang}, reading_score=reading_score)[lang]
 
     def multi_lang_readability_table(self):
         stats = self.get_mclwic_stats(reading_score='fre')
@@ -283,13 +249,16 @@ class Analysis:
 
         data, ctx_data = self.filter_valid_words_context(data, ctx_data)
 
-        stats = nested_dict()
+        cells = {}
         for type_ in data:
             for model in data[type_]:
-                stats[type_][model] = {
-                    'base': self.analyze_results(data[type_][model]),
-                    'ctx': self.analyze_results(ctx_data[type_][model]),
-                }
+                cells[(type_, model, 'base')] = data[type_][model]
+                cells[(type_, model, 'ctx')] = ctx_data[type_][model]
+        cell_stats = analyze_cells(cells)
+
+        stats = nested_dict()
+        for (type_, model, context), cell in cell_stats.items():
+            stats[type_][model][context] = cell
 
         table_data = defaultdict(lambda: defaultdict(list))
         table_data_small = defaultdict(lambda: defaultdict(list))
@@ -320,6 +289,10 @@ class Analysis:
         generate_context_table_small(table_data_small)
 
     def get_hown_results(self, w_context: bool = False):
+        if self.use_store:
+            stats = self.read_store_data('homonymy-high-freq', w_context, languages=['en'])
+            return self.filter_hown_valid_words({type_: langs['en'] for type_, langs in stats.items()})
+
         base_file = 'batches/homonymy-high-freq/{model}/homonymy-high-freq-{model}-output-judge-{type}'
         if w_context:
             base_file += "_w_context"
@@ -329,27 +302,31 @@ class Analysis:
     def get_hown_stats(self, w_context: bool = False):
         data = self.get_hown_results(w_context=w_context)
 
-        stats = nested_dict()
-        for type_ in data:
-            for model in data[type_]:
-                if model == 'DPO Llama 3.1 8B':
-                    continue
-                stats[type_][model] = self.analyze_results(data[type_][model])
+        cells = {(type_, model): data[type_][model]
+                 for type_ in data for model in data[type_] if model != 'DPO Llama 3.1 8B'}
 
+        stats = nested_dict()
+        for (type_, model), cell in analyze_cells(cells).items():
+            stats[type_][model] = cell
         return stats
 
     def get_mclwic_results(self):
+        if self.use_store:
+            return self.filter_mcl_valid_words(self.read_store_data('mcl-wic', False, self.LANGUAGES))
+
         base_file = 'batches/mcl-wic/{model}/mcl-wic-{model}-output-judge-{type}_{lang}-parsed-raw.jsonl'
         return self.read_model_lang_data(base_file)
 
     def get_mclwic_stats(self, reading_score='fre'):
         data = self.get_mclwic_results()
 
+        cells = {(type_, lang, model): results
+                 for type_, langs in data.items() for lang, models in langs.items() for model, results in models.items()}
+
         stats = nested_dict()
-        for type_, langs in data.items():
-            for lang, models in langs.items():
-                for model, results in models.items():
-                    stats[type_][lang][model] = self.analyze_results(results, lang=lang, reading_score=reading_score)
+        for (type_, lang, model), cell in analyze_cells(cells, langs={key: key[1] for key in cells},
+                                                        reading_score=reading_score).items():
+            stats[type_][lang][model] = cell
         return stats
 
     def hown_table(self):
@@ -405,15 +382,15 @@ class Analysis:
     def mclwic_model_overview_graph(self):
         data = self.get_mclwic_results()
 
-        stats = nested_dict()
+        cells = defaultdict(list)
         for type_, langs in data.items():
-            all_lang_results = defaultdict(list)
             for lang, models in langs.items():
                 for model, results in models.items():
-                    all_lang_results[model].extend(results)
+                    cells[(type_, model)].extend(results)
 
-            for model, results in all_lang_results.items():
-                stats[type_][model] = self.analyze_results(results, fk_grades=False, reading_score='fre')
+        stats = nested_dict()
+        for (type_, model), cell in analyze_cells(cells, fk_grades=False, reading_score='fre').items():
+            stats[type_][model] = cell
 
         table_data = defaultdict(lambda: defaultdict(list))
         for type_, models in stats.items():
@@ -594,23 +571,19 @@ class Analysis:
     def get_dpo_results(self):
         stats_dpo, stats, qwen_stats = {}, {}, {}
         all_data = []
-        reader = JSONLineReader()
 
-        base_file = 'batches/homonymy-high-freq/dpo-llama-v3p1-8b-instruct/homonymy-high-freq-dpo-llama-v3p1-8b-instruct-output-judge-{type}_en-parsed-raw.jsonl'
         for type_ in self.TYPES:
-            data = reader.read(base_file.format(type=type_))
+            data = self.read_hown_model_results('dpo-llama-v3p1-8b-instruct', type_)
             stats_dpo[type_] = data
             all_data.extend(data)
 
-        base_file = 'batches/homonymy-high-freq/llama-v3p1-8b-instruct/homonymy-high-freq-llama-v3p1-8b-instruct-output-judge-{type}_en-parsed-raw.jsonl'
         for type_ in self.TYPES:
-            data = reader.read(base_file.format(type=type_))
+            data = self.read_hown_model_results('llama-v3p1-8b-instruct', type_)
             stats[type_] = data
             all_data.extend(data)
 
-        base_file = 'batches/homonymy-high-freq/qwen3-30b-a3b/homonymy-high-freq-qwen3-30b-a3b-output-judge-{type}_en-parsed-raw.jsonl'
         for type_ in self.TYPES:
-            data = reader.read(base_file.format(type=type_))
+            data = self.read_hown_model_results('qwen3-30b-a3b', type_)
             qwen_stats[type_] = data
             all_data.extend(data)
 
@@ -639,16 +612,15 @@ class Analysis:
         dpo_dataset = load_dataset(Config.DATASETS['homonymy-dpo'], token=Credentials.hf_api_key)['train'].to_list()
         dpo_words = {entry['word'] for entry in dpo_dataset}
 
-        stats_without_dpo = {}
+        cells = {}
         for type_ in self.TYPES:
-            filtered_results_dpo = [entry for entry in results_dpo[type_] if entry['word'] not in dpo_words]
-            filtered_results = [entry for entry in results[type_] if entry['word'] not in dpo_words]
-            filtered_qwen_results = [entry for entry in qwen_results[type_] if entry['word'] not in dpo_words]
-            stats_without_dpo[type_] = {
-                'dpo': self.analyze_results(filtered_results_dpo),
-                'normal': self.analyze_results(filtered_results),
-                'qwen': self.analyze_results(filtered_qwen_results),
-            }
+            cells[(type_, 'dpo')] = [entry for entry in results_dpo[type_] if entry['word'] not in dpo_words]
+            cells[(type_, 'normal')] = [entry for entry in results[type_] if entry['word'] not in dpo_words]
+            cells[(type_, 'qwen')] = [entry for entry in qwen_results[type_] if entry['word'] not in dpo_words]
+
+        stats_without_dpo = defaultdict(dict)
+        for (type_, variant), cell in analyze_cells(cells).items():
+            stats_without_dpo[type_][variant] = cell
 
         table_data = defaultdict(list)
 
@@ -0,0 +1,115 @@
+"""Module for joining batch API results on their custom_id."""
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+REPORT_LIMIT = 10
+
+
+@dataclass(frozen=True)
+class TaskId:
+    """
+    Components of a batch task custom_id.
+
+    Supported formats are task-{idx}, task-{lang}-{type}-{idx} and
+    task-{sub_judgement}-{lang}-{context}-{type}-{idx}.
+    """
+    idx: int
+    sub_judgement: str | None = None
+    lang: str | None = None
+    context: bool | None = None
+    type: str | None = None
+
+    @property
+    def custom_id(self) -> str:
+        if self.sub_judgement is not None:
+            return f"task-{self.sub_judgement}-{self.lang}-{self.context}-{self.type}-{self.idx}"
+        if self.lang is not None:
+            return f"task-{self.lang}-{self.type}-{self.idx}"
+        return f"task-{self.idx}"
+
+
+def parse_custom_id(custom_id: str) -> TaskId:
+    """Parse a custom_id into its components."""
+    parts = custom_id.removeprefix('task-').split('-')
+    try:
+        if len(parts) == 1:
+            return TaskId(idx=int(parts[0]))
+        if len(parts) == 3:
+            lang, task_type, idx = parts
+            return TaskId(idx=int(idx), lang=lang, type=task_type)
+        if len(parts) == 5:
+            sub_judgement, lang, context, task_type, idx = parts
+            return TaskId(idx=int(idx), sub_judgement=sub_judgement, lang=lang, context=context == 'True',
+                          type=task_type)
+    except ValueError:
+        pass
+    raise ValueError(f"Unsupported custom_id: {custom_id}")
+
+
+class BatchJoiner:
+    """
+    Join batch result lines of several sources on their parsed custom_id.
+
+    Every source is indexed once in a dict, so a join is linear in the number of lines. Lines with a
+    duplicate custom_id (the first one is kept) and keys missing in a source are collected and
+    reported together by report().
+    """
+
+    def __init__(self, **sources: list[dict]):
+        self.indexes: dict[str, dict[TaskId, dict]] = {}
+        self.duplicates: dict[str, list[str]] = defaultdict(list)
+        self.missing: dict[str, list[str]] = defaultdict(list)
+        for name, lines in sources.items():
+            self.add_source(name, lines)
+
+    def add_source(self, name: str, lines: list[dict]):
+        index = {}
+        for line in lines:
+            key = parse_custom_id(line['custom_id'])
+            if key in index:
+                self.duplicates[name].append(line['custom_id'])
+                continue
+            index[key] = line
+        self.indexes[name] = index
+
+    def keys(self, name: str) -> list[TaskId]:
+        """Keys of a source in the order of its lines."""
+        return list(self.indexes[name])
+
+    def join(self, keys: Iterable[TaskId]) -> Iterator[tuple[TaskId, dict[str, dict]]]:
+        """
+        Yield the lines of all sources for each key.
+
+        :param keys: Keys to join on.
+        :return: Tuples of the key and a dict of the line of each source. Keys missing in any source
+                 are skipped and recorded for report().
+        """
+        for key in keys:
+            lines = {}
+            for name, index in self.indexes.items():
+                line = index.get(key)
+                if line is None:
+                    self.missing[name].append(key.custom_id)
+                    break
+                lines[name] = line
+            else:
+                yield key, lines
+
+    def report(self, strict: bool = True):
+        """
+        Print all duplicate and missing custom_ids found so far and reset them.
+
+        :param strict: Raise a ValueError if any custom_id is missing.
+        """
+        for problem, ids_by_source in (('duplicate', self.duplicates), ('missing', self.missing)):
+            for name, custom_ids in ids_by_source.items():
+                shown = ', '.join(custom_ids[:REPORT_LIMIT])
+                more = f" and {len(custom_ids) - REPORT_LIMIT} more" if len(custom_ids) > REPORT_LIMIT else ''
+                print(f"{len(custom_ids)} {problem} custom_ids in {name}: {shown}{more}")
+
+        missing = {name: len(custom_ids) for name, custom_ids in self.missing.items() if custom_ids}
+        self.duplicates.clear()
+        self.missing.clear()
+        if strict and missing:
+            raise ValueError(f"Missing custom_ids: {missing}")
@@ -0,0 +1,254 @@
+"""
+Module for running OpenAI Batch API jobs from submission to downloaded results.
+
+A job is described by a BatchJobSpec. Job spec files are json lists of specs, e.g.
+
+    [{"name": "judge-hown",
+      "input_file": "batches/homonymy-high-freq/homonymy-high-freq-input-judge-simple.jsonl",
+      "output_file": "batches/homonymy-high-freq/homonymy-high-freq-raw-output-judge-simple.jsonl",
+      "endpoint": "/v1/responses"}]
+
+and are run with `python batch_orchestrator.py jobs.json`.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+
+from openai.types import Batch
+
+from config import Config
+from llm_client import OpenAIClient
+from reader import JSONLineReader, JSONReader
+
+FINISHED_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+@dataclass
+class BatchJobSpec:
+    name: str
+    # Task file with one request per line, identified by its custom_id.
+    input_file: str
+    # Successful result lines are appended here as the batches complete.
+    output_file: str
+    endpoint: str = "/v1/chat/completions"
+    # Entry of Config.SUPPORTED_LLMS providing the credentials, base_url overrides its endpoint.
+    llm: str = Config.DEFAULT_RESPONSE_LLM
+    base_url: str | None = None
+    completion_window: str = "24h"
+    # Limits of a single batch, the OpenAI limits are 50,000 requests and 200 MB.
+    max_requests: int = 50_000
+    max_bytes: int = 190 * 1024 * 1024
+    # Attempts per request, failed and expired requests are resubmitted in a new batch.
+    max_attempts: int = 3
+    poll_interval: float = 30
+    max_poll_interval: float = 600
+    submit_workers: int = 4
+
+    @property
+    def shard_dir(self) -> str:
+        return f"{self.output_file}.shards"
+
+    @property
+    def state_file(self) -> str:
+        return f"{self.output_file}.batches.json"
+
+    @property
+    def errors_file(self) -> str:
+        return f"{self.output_file}.errors.jsonl"
+
+
+def load_job_specs(file_name: str) -> list[BatchJobSpec]:
+    """Load the job specs of a json spec file."""
+    return [BatchJobSpec(**spec) for spec in JSONReader().read(file_name)]
+
+
+class BatchOrchestrator:
+    """
+    Run a batch job: split, submit, poll, download and resubmit failures.
+
+    The input tasks are split into shards within the request and byte limits of a batch and the shards
+    are submitted concurrently. Batches are polled with exponential backoff and the successful results
+    of every finished batch are appended to the output file right away. Afterwards all tasks without a
+    successful result, i.e. failed requests and the unprocessed requests of expired, failed or cancelled
+    batches, are resubmitted until max_attempts is reached. Requests that fail in every attempt are
+    written to the errors file with their last error.
+
+    The batches in flight are recorded in the state file, so an interrupted run picks them up again
+    instead of submitting new ones. Errors are appended to the errors file as they are collected, so a
+    resumed run still knows the errors of the batches finished before the interruption.
+    """
+
+    def __init__(self, spec: BatchJobSpec, client: OpenAIClient | None = None):
+        self.spec = spec
+        if client is None:
+            config = Config.get_llm_config(spec.llm)
+            if spec.base_url:
+                config = replace(config, base_url=spec.base_url)
+            client = OpenAIClient(config)
+        self.client = client
+        self.errors: dict[str, dict] = {}
+        self.succeeded: set[str] = set()
+
+    def run(self) -> dict:
+        """
+        Run the job until every task succeeded or ran out of attempts.
+
+        :return: Summary with the number of tasks, succeeded and failed tasks and attempts.
+        """
+        spec = self.spec
+        tasks = {task['custom_id']: task for task in JSONLineReader().read(spec.input_file)}
+        state = self._load_state()
+        attempt = state.get('attempt', 1)
+        if state:
+            self.errors = self._load_errors()
+        elif os.path.exists(spec.errors_file):
+            os.remove(spec.errors_file)
+        self.succeeded = self._succeeded_ids()
+
+        while True:
+            if state.get('shards'):
+                print(f"{spec.name}: resuming attempt {attempt} with {len(state['shards'])} batches")
+            else:
+                pending = [task for custom_id, task in tasks.items() if custom_id not in self.succeeded]
+                if not pending or attempt > spec.max_attempts:
+                    break
+                shard_files = self.split(pending, attempt)
+                state = {'attempt': attempt, 'shards': {shard_file: None for shard_file in shard_files}}
+                print(f"{spec.name}: attempt {attempt} submits {len(pending)} tasks in {len(shard_files)} batches")
+
+            self._run_attempt(state)
+            attempt += 1
+            state = {'attempt': attempt}
+            self._save_state(state)
+
+        failed = [custom_id for custom_id in tasks if custom_id not in self.succeeded]
+        JSONLineReader().write(spec.errors_file, [
+            {'custom_id': custom_id, 'error': self.errors.get(custom_id)} for custom_id in failed
+        ], mode='w')
+        if failed:
+            print(f"{spec.name}: {len(failed)} tasks failed {spec.max_attempts} attempts, see {spec.errors_file}")
+
+        if os.path.exists(spec.state_file):
+            os.remove(spec.state_file)
+        shutil.rmtree(spec.shard_dir, ignore_errors=True)
+        return {'name': spec.name, 'tasks': len(tasks), 'succeeded': len(tasks) - len(failed),
+                'failed': len(failed), 'attempts': attempt - 1}
+
+    def split(self, tasks: list[dict], attempt: int) -> list[str]:
+        """Write the tasks into shard files within the request and byte limits of a batch."""
+        shards = []
+        current, current_bytes = [], 0
+        for task in tasks:
+            task_bytes = len(json.dumps(task, ensure_ascii=False).encode('utf-8')) + 1
+            if current and (len(current) >= self.spec.max_requests
+                            or current_bytes + task_bytes > self.spec.max_bytes):
+                shards.append(current)
+                current, current_bytes = [], 0
+            current.append(task)
+            current_bytes += task_bytes
+        if current:
+            shards.append(current)
+
+        shard_files = []
+        for idx, shard in enumerate(shards):
+            shard_file = os.path.join(self.spec.shard_dir, f"attempt-{attempt}-shard-{idx:03d}.jsonl")
+            JSONLineReader().write(shard_file, shard, mode='w')
+            shard_files.append(shard_file)
+        return shard_files
+
+    def _run_attempt(self, state: dict):
+        spec = self.spec
+        shards = state['shards']
+        unsubmitted = [shard_file for shard_file, batch_id in shards.items() if batch_id is None]
+        with ThreadPoolExecutor(max_workers=spec.submit_workers) as executor:
+            batches = executor.map(
+                lambda shard_file: self.client.create_batch_job(shard_file, spec.endpoint, spec.completion_window),
+                unsubmitted
+            )
+            for shard_file, batch in zip(unsubmitted, batches):
+                shards[shard_file] = batch.id
+                self._save_state(state)
+
+        interval = spec.poll_interval
+        while shards:
+            progressed = False
+            for shard_file, batch_id in list(shards.items()):
+                batch = self.client.retrieve_batch(batch_id)
+                if batch.status not in FINISHED_STATUSES:
+                    continue
+                self._collect(batch)
+                print(f"{spec.name}: batch {batch.id} {batch.status} "
+                      f"({batch.request_counts.completed if batch.request_counts else 0} completed, "
+                      f"{batch.request_counts.failed if batch.request_counts else 0} failed)")
+                del shards[shard_file]
+                self._save_state(state)
+                progressed = True
+
+            if shards:
+                interval = spec.poll_interval if progressed else min(spec.max_poll_interval, interval * 2)
+                time.sleep(interval)
+
+    def _collect(self, batch: Batch):
+        """Append the successful results of a finished batch to the output file and its errors to the errors file."""
+        results, errors = [], []
+        if batch.output_file_id:
+            for line in self._download(batch.output_file_id):
+                if (line.get('response') or {}).get('status_code') == 200:
+                    # A batch collected right before an interruption is collected again on resume.
+                    if line['custom_id'] not in self.succeeded:
+                        results.append(line)
+                else:
+                    errors.append({'custom_id': line['custom_id'], 'error': line.get('error') or line.get('response')})
+        if batch.error_file_id:
+            for line in self._download(batch.error_file_id):
+                errors.append({'custom_id': line['custom_id'], 'error': line.get('error') or line.get('response')})
+        JSONLineReader().write(self.spec.output_file, results)
+        self.succeeded.update(line['custom_id'] for line in results)
+        JSONLineReader().write(self.spec.errors_file, errors)
+        self.errors.update((error['custom_id'], error['error']) for error in errors)
+
+    def _download(self, file_id: str) -> list[dict]:
+        content = self.client.get_file_content(file_id).decode('utf-8')
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    def _succeeded_ids(self) -> set[str]:
+        if not os.path.exists(self.spec.output_file):
+            return set()
+        return {line['custom_id'] for line in JSONLineReader().read(self.spec.output_file)}
+
+    def _load_errors(self) -> dict[str, dict]:
+        """Last collected error of every custom_id in the errors file."""
+        if not os.path.exists(self.spec.errors_file):
+            return {}
+        return {line['custom_id']: line['error'] for line in JSONLineReader().read(self.spec.errors_file)}
+
+    def _load_state(self) -> dict:
+        if not os.path.exists(self.spec.state_file):
+            return {}
+        return JSONReader().read(self.spec.state_file)
+
+    def _save_state(self, state: dict):
+        JSONReader().write(self.spec.state_file, state, mode='w')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the OpenAI batch jobs of a job spec file.")
+    parser.add_argument('spec_file', help='Json file with a list of batch job specs.')
+    parser.add_argument('--base-url', help='Override the API base url of all jobs, e.g. of a fake batch server.')
+    args = parser.parse_args()
+
+    specs = load_job_specs(args.spec_file)
+    if args.base_url:
+        specs = [replace(spec, base_url=args.base_url) for spec in specs]
+
+    with ThreadPoolExecutor(max_workers=len(specs) or 1) as executor:
+        for summary in executor.map(lambda spec: BatchOrchestrator(spec).run(), specs):
+            print(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the embedding backends of EvaluationParser on the parsed results.
+
+The wordnet_rankings and coarse_synsets_covered of the given parsed files, computed with the float32
+torch model, are the reference. For each backend the definitions are ranked again and the share of
+definitions with the same ranking and of results with the same coverage is reported together with
+the encoding throughput. The script exits with status 1 if a backend agrees on fewer rankings than
+--min-agreement.
+
+Usage: python benchmarks/embedding_backends.py batches/homonymy-high-freq/*/*_en-parsed-raw.jsonl
+"""
+import argparse
+import copy
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from evaluation_parser import EMBEDDING_BACKENDS, EvaluationParser
+from reader import JSONLineReader
+
+FIELDS = ('word', 'definitions', 'wordnet_rankings', 'coarse_synsets_covered')
+
+
+def share_equal(pairs: list[tuple]) -> float:
+    return sum(expected == found for expected, found in pairs) / len(pairs) if pairs else 1.0
+
+
+def compare(reference: list[dict], results: list[dict]) -> dict:
+    """Agreement of the rankings and coverage of results with the reference results."""
+    rankings = [(expected, found) for ref, result in zip(reference, results)
+                for expected, found in zip(ref['wordnet_rankings'], result['wordnet_rankings'])]
+    coverage = [(ref['coarse_synsets_covered'], result['coarse_synsets_covered'])
+                for ref, result in zip(reference, results)]
+    mean_abs_diff = sum(abs(expected - found) for expected, found in coverage) / len(coverage) if coverage else 0.0
+    return {'ranking_agreement': share_equal(rankings), 'coverage_agreement': share_equal(coverage),
+            'coverage_mean_abs_diff': mean_abs_diff}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check accuracy and throughput of the embedding backends.")
+    parser.add_argument('files', nargs='+', help='Parsed result files with wordnet_rankings.')
+    parser.add_argument('--backends', nargs='+', default=list(EMBEDDING_BACKENDS), choices=list(EMBEDDING_BACKENDS))
+    parser.add_argument('--min-agreement', type=float, default=0.98)
+    args = parser.parse_args()
+
+    reference = [result for file in args.files for result in JSONLineReader().iter(file, fields=FIELDS)
+                 if 'wordnet_rankings' in result]
+    definitions = [definition for result in reference for definition in result['definitions']]
+    print(f"{len(reference)} results with {len(definitions)} definitions from {len(args.files)} files")
+
+    failed = []
+    for backend in args.backends:
+        evaluation_parser = EvaluationParser(backend)
+        evaluation_parser.encode(definitions[:32])  # Load and warm up the model outside of the timing.
+        start = time.perf_counter()
+        evaluation_parser.encode(definitions)
+        seconds = time.perf_counter() - start
+
+        results = [{key: copy.deepcopy(result[key]) for key in ('word', 'definitions')} for result in reference]
+        results = evaluation_parser.add_wordnet_rankings(results)
+        metrics = compare(reference, results)
+        print(f"{backend:>10}: {len(definitions) / seconds:8.0f} definitions/s, "
+              f"rankings {metrics['ranking_agreement']:.2%} equal, "
+              f"coverage {metrics['coverage_agreement']:.2%} equal "
+              f"(mean abs diff {metrics['coverage_mean_abs_diff']:.4f})")
+        if metrics['ranking_agreement'] < args.min_agreement:
+            failed.append(backend)
+
+    if failed:
+        sys.exit(f"Ranking agreement below {args.min_agreement:.0%} for {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
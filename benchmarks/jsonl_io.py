@@ -0,0 +1,67 @@
+"""
+Compare the json backends of reader.py and per-record writes against JSONLineAppender.
+
+Reads every .jsonl file below the given directory with each available backend and rewrites its
+records one by one, once with JSONLineReader().write(file, [record]) per record as the generation
+scripts used to, and once through a JSONLineAppender.
+
+Usage: python benchmarks/jsonl_io.py batches/ --max-files 50
+"""
+import argparse
+from collections import deque
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from reader import JSON_BACKENDS, JSONLineAppender, JSONLineReader, set_json_backend
+
+
+def time_it(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def write_per_record(file_name: str, records: list[dict]):
+    for record in records:
+        JSONLineReader().write(file_name, [record])
+
+
+def write_appender(file_name: str, records: list[dict]):
+    with JSONLineAppender(file_name) as appender:
+        for record in records:
+            appender.write(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark jsonl reading and writing.")
+    parser.add_argument('directory', type=str, help='Directory with .jsonl files, e.g. batches/')
+    parser.add_argument('--max-files', type=int, default=None, help='Only use the first max files.')
+    args = parser.parse_args()
+
+    files = sorted(str(path) for path in Path(args.directory).rglob('*.jsonl'))[:args.max_files]
+    total_bytes = sum(os.path.getsize(file) for file in files)
+    print(f"{len(files)} files, {total_bytes / 1e6:.1f} MB, backends: {', '.join(JSON_BACKENDS)}")
+
+    for name in JSON_BACKENDS:
+        set_json_backend(name)
+        reader = JSONLineReader()
+        seconds = time_it(lambda: deque((record for file in files for record in reader.iter(file)), maxlen=0))
+        print(f"read  {name:>6}: {seconds:7.2f}s ({total_bytes / 1e6 / seconds:6.1f} MB/s)")
+    records = [record for file in files for record in JSONLineReader().iter(file)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in JSON_BACKENDS:
+            set_json_backend(name)
+            for label, write in (('per-record', write_per_record), ('appender', write_appender)):
+                out_file = os.path.join(tmp_dir, f"{name}-{label}.jsonl")
+                seconds = time_it(lambda: write(out_file, records))
+                print(f"write {name:>6} {label:>10}: {seconds:7.2f}s ({len(records) / seconds:9.0f} records/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure the prefill speedup of reusing the evaluated prompt prefix in LLamaCPPClient.
+
+Usage: python benchmarks/llamacpp_prefix_reuse.py path/to/model.gguf --prompt-types simple_w_context_en simple_en
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from statistics import mean, median
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import LLMConfig
+from evaluation import PROMPT_TEMPLATES
+from llm_client import LLamaCPPClient
+
+WORDS = ['bank', 'bat', 'bark', 'bass', 'bow', 'crane', 'date', 'fair', 'jam', 'kind', 'lead', 'match', 'mine',
+         'mole', 'nail', 'palm', 'pitch', 'pupil', 'ring', 'rock', 'seal', 'spring', 'tear', 'tire', 'watch']
+
+
+def time_prompts(client: LLamaCPPClient, prompts: list[str]) -> list[float]:
+    timings = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        client.define_term(prompt)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def load_client(model: str, max_tokens: int) -> LLamaCPPClient:
+    client = LLamaCPPClient(LLMConfig(model=model))
+    client.DECODING_PARAMS = {**LLamaCPPClient.DECODING_PARAMS, 'max_tokens': max_tokens}
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt prefix reuse of LLamaCPPClient.")
+    parser.add_argument('model', type=str, help='Path to a (small) GGUF model.')
+    parser.add_argument('--prompt-types', type=str, nargs='+', default=['simple_w_context_en'],
+                        help='Keys of the prompt templates, the prompts alternate between them. Default: %(default)s')
+    parser.add_argument('--max-tokens', type=int, default=1,
+                        help='Generated tokens per prompt, keep it small to measure the prefill. Default: %(default)s')
+    args = parser.parse_args()
+
+    prompt_templates = [PROMPT_TEMPLATES[prompt_type] for prompt_type in args.prompt_types]
+    prompts = [prompt_template.format(word=word) for word in WORDS for prompt_template in prompt_templates]
+
+    # Both clients run the same prompts in the same order, the plain one only relies on the
+    # prefix matching of llama.cpp itself.
+    plain = load_client(args.model, args.max_tokens)
+    time_prompts(plain, prompts)  # warm up
+    full = time_prompts(plain, prompts)
+    del plain
+
+    cached = load_client(args.model, args.max_tokens)
+    for prompt_template in prompt_templates:
+        cached.cache_prompt_prefix(prompt_template.split('{word}')[0])
+    time_prompts(cached, prompts)  # warm up
+    reused = time_prompts(cached, prompts)
+
+    for name, timings in [('plain client', full), ('prefix cache', reused)]:
+        print(f"{name}: mean {mean(timings) * 1000:.1f} ms, median {median(timings) * 1000:.1f} ms per prompt")
+    print(f"speedup: {mean(full) / mean(reused):.2f}x")
+
+
+if __name__ == "__main__":
+    main()
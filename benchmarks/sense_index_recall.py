@@ -0,0 +1,100 @@
+"""
+Measure the recall and speed of the sense index against exact search.
+
+For the definitions of the given parsed result files two recalls are reported per n_probe:
+- per-lemma recall@k: share of definitions matched by the exact per-lemma ranking of EvaluationParser
+  whose matched synset is among the top k senses of the index,
+- exact recall@k: overlap of the top k senses of the index with the top k of a brute force search
+  over all glosses.
+
+Usage: python benchmarks/sense_index_recall.py batches/homonymy-high-freq/*/*_en-parsed-raw.jsonl
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from gloss_matrix import normalize
+from reader import JSONLineReader
+from sense_index import SenseIndex
+
+
+def exact_top_k(index: SenseIndex, queries: np.ndarray, k: int, chunk_size: int = 256) -> list[list[str]]:
+    """Top k senses of each query by brute force over all glosses of the index."""
+    queries = normalize(queries)
+    vectors = np.asarray(index.vectors, dtype=np.float32)
+    senses = []
+    for start in range(0, len(queries), chunk_size):
+        similarities = queries[start:start + chunk_size] @ vectors.T
+        best = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        for row, candidates in zip(similarities, best):
+            senses.append([index.synset_names[i] for i in candidates[np.argsort(-row[candidates])]])
+    return senses
+
+
+def recall(found: list[list[str]], expected: list[list[str]]) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    total = sum(len(e) for e in expected)
+    return hits / total if total else 0.0
+
+
+def run(index: SenseIndex, queries: np.ndarray, per_lemma: list[str | None], ks: list[int], n_probes: list[int]):
+    """Print recall and throughput of the index for each n_probe."""
+    start = time.perf_counter()
+    exact = exact_top_k(index, queries, max(ks))
+    exact_seconds = time.perf_counter() - start
+    print(f"{len(queries)} definitions, {len(index)} glosses, {len(index.centroids)} clusters")
+    print(f"exact search: {len(queries) / exact_seconds:8.0f} definitions/s")
+
+    matched = [i for i, name in enumerate(per_lemma) if name is not None]
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        found = [[name for name, _ in senses] for senses in index.top_k_senses(queries, max(ks), n_probe)]
+        seconds = time.perf_counter() - start
+        recalls = []
+        for k in ks:
+            lemma_recall = recall([found[i][:k] for i in matched], [[per_lemma[i]] for i in matched])
+            exact_recall = recall([senses[:k] for senses in found], [senses[:k] for senses in exact])
+            recalls.append(f"@{k}: lemma {lemma_recall:.3f} exact {exact_recall:.3f}")
+        print(f"n_probe {n_probe:3d}: {len(queries) / seconds:8.0f} definitions/s, {', '.join(recalls)}")
+
+
+def main():
+    from nltk.corpus import wordnet as wn
+
+    from evaluation_parser import EvaluationParser
+
+    parser = argparse.ArgumentParser(description="Benchmark the sense index against exact search.")
+    parser.add_argument('files', nargs='+', help='Parsed result files with definitions.')
+    parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--max-definitions', type=int, default=5000)
+    args = parser.parse_args()
+
+    evaluation_parser = EvaluationParser()
+    index = evaluation_parser.sense_index
+    if index is None:
+        sys.exit("No sense index built, run sense_index.py first.")
+
+    results = [{'word': result['word'], 'definitions': result['definitions']}
+               for file in args.files for result in JSONLineReader().iter(file, fields=('word', 'definitions'))
+               if result.get('definitions')]
+    results = evaluation_parser.add_wordnet_rankings(results)
+
+    definitions, per_lemma = [], []
+    for result in results:
+        synsets = wn.synsets(result['word'].replace(' ', '_'), pos='n')
+        for definition, ranking in zip(result['definitions'], result['wordnet_rankings']):
+            definitions.append(definition)
+            per_lemma.append(synsets[ranking].name() if ranking != -1 else None)
+    definitions, per_lemma = definitions[:args.max_definitions], per_lemma[:args.max_definitions]
+
+    run(index, evaluation_parser.encode(definitions), per_lemma, args.k, args.n_probe)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Module for persistent, content-addressed caches."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+
+class CacheMissError(KeyError):
+    """Raised in cache-only mode when a request is not cached."""
+
+
+def make_key(*parts) -> str:
+    """Hash the json representation of the given parts into a cache key."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), {self.evictions} evicted"
+
+
+class DiskCache:
+    """
+    Key-value cache stored in a SQLite database.
+
+    Values are json serialized. The database runs in WAL mode with a busy timeout, so several
+    threads and worker processes can read and write the same cache file. When more than
+    max_entries are stored, the least recently used entries are evicted.
+    """
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path: str, max_entries: int | None = 200_000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS entries '
+                           '(key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of the current thread, SQLite connections must not be shared."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str, default=None):
+        """Return the cached value for key or default if it is not cached."""
+        connection = self._connection()
+        row = connection.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        with self._lock:
+            if row is None:
+                self.stats.misses += 1
+                return default
+            self.stats.hits += 1
+
+        connection.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), key))
+        connection.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value):
+        """Store value under key."""
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO entries (key, value, accessed) VALUES (?, ?, ?)',
+                           (key, json.dumps(value, ensure_ascii=False), time.time()))
+        connection.commit()
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until at most max_entries are left."""
+        if self.max_entries is None:
+            return
+        connection = self._connection()
+        overflow = len(self) - self.max_entries
+        if overflow <= 0:
+            return
+        connection.execute('DELETE FROM entries WHERE key IN '
+                           '(SELECT key FROM entries ORDER BY accessed LIMIT ?)', (overflow,))
+        connection.commit()
+        with self._lock:
+            self.stats.evictions += overflow
+
+    def __contains__(self, key: str) -> bool:
+        return self._connection().execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+class EmbeddingCache:
+    """
+    Embeddings stored in a SQLite database, keyed by embedding model and name.
+
+    Embeddings are stored as raw float32 bytes, so reading them back does not need any parsing.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.stats = CacheStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        connection = self._connection()
+        connection.execute('CREATE TABLE IF NOT EXISTS embeddings '
+                           '(model TEXT NOT NULL, name TEXT NOT NULL, embedding BLOB NOT NULL, '
+                           'PRIMARY KEY (model, name))')
+        connection.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, model: str, names: list[str]) -> dict[str, np.ndarray]:
+        """Return the cached embeddings of the given names, names that are not cached are left out."""
+        connection = self._connection()
+        found = {}
+        # Stay below the SQLite limit of variables per statement.
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            rows = connection.execute(
+                f'SELECT name, embedding FROM embeddings WHERE model = ? AND name IN ({",".join("?" * len(chunk))})',
+                (model, *chunk)
+            ).fetchall()
+            found.update((name, np.frombuffer(embedding, dtype=np.float32)) for name, embedding in rows)
+        with self._lock:
+            self.stats.hits += len(found)
+            self.stats.misses += len(set(names)) - len(found)
+        return found
+
+    def set_many(self, model: str, embeddings: dict[str, np.ndarray]):
+        """Store the embeddings of several names."""
+        connection = self._connection()
+        connection.executemany('INSERT OR REPLACE INTO embeddings (model, name, embedding) VALUES (?, ?, ?)',
+                               [(model, name, np.asarray(embedding, dtype=np.float32).tobytes())
+                                for name, embedding in embeddings.items()])
+        connection.commit()
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
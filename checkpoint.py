@@ -0,0 +1,83 @@
+"""Module for resuming interrupted response generation runs."""
+import json
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime
+
+from config import Config
+from reader import JSONLineReader
+
+
+@dataclass
+class RunManifest:
+    """Summary of a run, stored next to its output file."""
+    model: str
+    prompt_key: str
+    dataset: str
+    dataset_revision: str | None = None
+    completed: int = 0
+    total: int = 0
+    updated: str | None = None
+
+    @staticmethod
+    def manifest_file(output_file: str) -> str:
+        return f"{output_file}.manifest.json"
+
+    def save(self, output_file: str):
+        self.updated = datetime.now().isoformat(timespec='seconds')
+        with open(self.manifest_file(output_file), 'w', encoding='utf-8') as file:
+            json.dump(asdict(self), file, indent=2)
+
+    @classmethod
+    def load(cls, output_file: str) -> 'RunManifest | None':
+        if not os.path.exists(cls.manifest_file(output_file)):
+            return None
+        with open(cls.manifest_file(output_file), 'r', encoding='utf-8') as file:
+            return cls(**json.load(file))
+
+
+def dataset_revision(repo_id: str) -> str | None:
+    """Return the commit sha of a dataset on the HF hub, or None if it can't be looked up."""
+    try:
+        from huggingface_hub import HfApi
+        return HfApi().dataset_info(repo_id, token=Config.CREDENTIALS.hf_api_key).sha
+    except Exception as e:
+        print(f"Could not look up the revision of {repo_id}: {e}")
+        return None
+
+
+def repair_jsonl(file_name: str):
+    """Cut off a last line that was only partially written, e.g. because the run crashed."""
+    with open(file_name, 'rb+') as file:
+        content = file.read()
+        end = len(content)
+        if content and not content.endswith(b'\n'):
+            end = content.rfind(b'\n') + 1
+        else:
+            last_start = content.rfind(b'\n', 0, max(end - 1, 0)) + 1
+            try:
+                json.loads(content[last_start:end])
+            except json.JSONDecodeError:
+                end = last_start
+        if end < len(content):
+            print(f"Removing truncated last line of {file_name}")
+            file.truncate(end)
+
+
+def resume_offset(homonyms: list[dict], output_file: str) -> int:
+    """
+    Return how many of the leading homonyms already have a result in output_file.
+
+    Results are matched by position, as the judge batches align response lines with dataset rows,
+    and every present word is checked against the dataset.
+    """
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        return 0
+
+    repair_jsonl(output_file)
+    words = [result.get('word') for result in JSONLineReader().read(output_file)]
+    if len(words) > len(homonyms) or any(word != h['word'] for word, h in zip(words, homonyms)):
+        raise ValueError(f"{output_file} does not match the dataset, can't resume from it")
+    if words:
+        print(f"Resuming {output_file} after {len(words)} of {len(homonyms)} words")
+    return len(words)
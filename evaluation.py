@@ -1,9 +1,16 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
 from tqdm import tqdm
 
-from LLMJudge import LLMJudge
+from LLMJudge import LLMJudge, SubJudgementError
+from cache import DiskCache
+from checkpoint import RunManifest, dataset_revision, resume_offset
 from config import Config
 from llm_client import get_llm_client
-from reader import JSONLineReader
+from reader import JSONLineAppender
 
 PROMPT_TEMPLATES = {
     'child_en': "Explain '{word}' like I am 5 years old.",
@@ -38,26 +45,187 @@ PROMPT_TEMPLATES = {
     "normal_w_context_zh": "「{word}」的定义是什么？如果这个词有不同的语境，请考虑这些语境，或者询问我需要哪一种。",
 }
 
+@dataclass
+class StageStats:
+    """Throughput counters of one pipeline stage."""
+    name: str
+    workers: int
+    completed: int = 0
+    busy_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Completed items per second of wall time."""
+        return self.completed / self.wall_seconds if self.wall_seconds else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """Share of the available worker time spent on calls. The bottleneck stage is close to 1."""
+        return self.busy_seconds / (self.wall_seconds * self.workers) if self.wall_seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.name}: {self.completed} done, {self.throughput:.2f}/s, "
+                f"{self.utilization:.0%} busy ({self.workers} workers)")
+
+
 class HomonymEvaluator:
-    def __init__(self, response_llm, prompt_type: str):
+    def __init__(self, response_llm, prompt_type: str, generation_workers: int = 8, judge_workers: int = 8,
+                 queue_size: int = 16, judge_cache: DiskCache | None = None,
+                 response_cache: DiskCache | None = None, cache_only: bool = False, judge_attempts: int = 3):
         self.response_client = get_llm_client(response_llm)
-        self.judge_client = LLMJudge()
+        if response_cache is not None:
+            self.response_client.use_cache(response_cache, cache_only=cache_only)
+        self.judge_client = LLMJudge(max_workers=2 * judge_workers, cache=judge_cache)
         self.ngram_config = Config.NGRAM_CONFIG
+        self.prompt_type = prompt_type
         self.prompt_template = PROMPT_TEMPLATES[prompt_type]
+        self.response_style = prompt_type.split('_')[0]
+        self.generation_workers = generation_workers
+        if self.response_client.max_concurrency:
+            self.generation_workers = min(self.generation_workers, self.response_client.max_concurrency)
+        self.generation_batch_size = self.response_client.batch_size
+        self.judge_workers = judge_workers
+        self.judge_attempts = judge_attempts
+        self.queue_size = queue_size
+        self.stats: dict[str, StageStats] = {}
+
+    def evaluate_homonyms(self, homonyms: list[dict], output_file: str, resume: bool = False,
+                          dataset: str | None = None) -> list:
+        """
+        Evaluate the homonyms and append the results to output_file.
+
+        :param homonyms: Dataset rows, each with a word.
+        :param output_file: Jsonl file the results are appended to.
+        :param resume: Skip the leading homonyms that already have a result in output_file.
+        :param dataset: HF repo id of the homonyms, recorded with its revision in the run manifest.
+        :return: The results of the evaluated (not skipped) homonyms.
+        """
+        offset = resume_offset(homonyms, output_file) if resume else 0
+        manifest = RunManifest(
+            model=self.response_client.model,
+            prompt_key=self.prompt_type,
+            dataset=dataset,
+            dataset_revision=dataset_revision(dataset) if dataset else None,
+            completed=offset,
+            total=len(homonyms),
+        )
+        results = asyncio.run(self.aevaluate_homonyms(homonyms[offset:], output_file, manifest))
+        for stage_stats in self.stats.values():
+            print(stage_stats)
+        if getattr(self.response_client, 'rate_limiter', None) is not None:
+            print(f"Rate limiter: {self.response_client.rate_limiter.stats}")
+        if self.response_client.cache is not None:
+            print(f"Response cache: {self.response_client.cache.stats}")
+        if self.judge_client.cache is not None:
+            print(f"Judge cache: {self.judge_client.cache.stats}")
+        return results
+
+    async def aevaluate_homonyms(self, homonyms: list[dict], output_file: str,
+                                 manifest: RunManifest | None = None) -> list:
+        """
+        Evaluate the homonyms in a two-stage generate -> judge pipeline.
 
-    def evaluate_homonyms(self, homonyms: list[dict], output_file: str) -> list:
-        results = []
-        for h in tqdm(homonyms):
-            word = h["word"]
-            prompt = self.prompt_template.format(word=word)
-            model_response = self.response_client.define_term(prompt)
-            evaluation = self.judge_client.judge_response(prompt, model_response)
-            result = {
-                "word": word,
-                "model_response": model_response,
-                "evaluation": evaluation,
-                "avg_google_ngrams_frequency": h["avg_google_ngrams_frequency"]
-            }
-            results.append(result)
-            JSONLineReader().write(output_file, [result])
+        Both stages have their own worker pool and are connected by a bounded queue, so the response
+        model keeps generating while earlier responses are judged. Results are appended to
+        output_file as soon as all preceding words are finished, so the file always has the same
+        order as homonyms.
+        """
+        loop = asyncio.get_running_loop()
+        generate_queue = asyncio.Queue()
+        judge_queue = asyncio.Queue(maxsize=self.queue_size)
+        results = [None] * len(homonyms)
+        next_to_write = 0
+        generate_stats = StageStats('generate', self.generation_workers)
+        judge_stats = StageStats('judge', self.judge_workers)
+        self.stats = {'generate': generate_stats, 'judge': judge_stats}
+
+        def write_finished():
+            nonlocal next_to_write
+            finished = []
+            while next_to_write < len(results) and results[next_to_write] is not None:
+                finished.append(results[next_to_write])
+                next_to_write += 1
+            if finished:
+                appender.write_all(finished)
+                if manifest is not None:
+                    manifest.completed += len(finished)
+                    manifest.save(output_file)
+
+        async def run_stage(executor: ThreadPoolExecutor, stage_stats: StageStats, count: int, func, *args):
+            start = time.perf_counter()
+            output = await loop.run_in_executor(executor, func, *args)
+            stage_stats.busy_seconds += time.perf_counter() - start
+            stage_stats.completed += count
+            return output
+
+        async def generate_worker(executor: ThreadPoolExecutor):
+            while (idx := await generate_queue.get()) is not None:
+                # Clients with batch support get up to generation_batch_size words per call.
+                batch = [idx]
+                while len(batch) < self.generation_batch_size and not generate_queue.empty():
+                    if (idx := generate_queue.get_nowait()) is None:
+                        generate_queue.put_nowait(None)
+                        break
+                    batch.append(idx)
+
+                prompts = [self.prompt_template.format(word=homonyms[idx]["word"]) for idx in batch]
+                model_responses = await run_stage(executor, generate_stats, len(batch),
+                                                  self.response_client.define_terms, prompts)
+                for idx, prompt, model_response in zip(batch, prompts, model_responses):
+                    await judge_queue.put((idx, prompt, model_response))
+
+        async def judge_worker(executor: ThreadPoolExecutor):
+            while (item := await judge_queue.get()) is not None:
+                idx, prompt, model_response = item
+                evaluation = await run_stage(executor, judge_stats, 1, self.judge, prompt, model_response)
+                results[idx] = self.build_result(homonyms[idx], model_response, evaluation)
+                progress.update()
+                write_finished()
+
+        for idx in range(len(homonyms)):
+            generate_queue.put_nowait(idx)
+        for _ in range(self.generation_workers):
+            generate_queue.put_nowait(None)
+
+        start = time.perf_counter()
+        with (ThreadPoolExecutor(max_workers=self.generation_workers) as generate_executor,
+              ThreadPoolExecutor(max_workers=self.judge_workers) as judge_executor,
+              JSONLineAppender(output_file) as appender,
+              tqdm(total=len(homonyms)) as progress):
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(self.judge_workers):
+                    tg.create_task(judge_worker(judge_executor))
+                generators = [tg.create_task(generate_worker(generate_executor))
+                              for _ in range(self.generation_workers)]
+                await asyncio.gather(*generators)
+                generate_stats.wall_seconds = time.perf_counter() - start
+                for _ in range(self.judge_workers):
+                    await judge_queue.put(None)
+        judge_stats.wall_seconds = time.perf_counter() - start
         return results
+
+    def judge(self, prompt: str, model_response: str) -> dict:
+        """
+        Judge a response, retrying only the failed sub-judgements up to judge_attempts times.
+
+        If they still fail, the SubJudgementError stops the run, the results written so far are kept
+        and the word is judged again on resume.
+        """
+        sub_results = {}
+        for attempt in range(1, self.judge_attempts + 1):
+            try:
+                return self.judge_client.judge_response(prompt, model_response, self.response_style, sub_results)
+            except SubJudgementError as e:
+                if attempt == self.judge_attempts:
+                    raise
+                sub_results = e.results
+
+    @staticmethod
+    def build_result(homonym: dict, model_response: str, evaluation: dict) -> dict:
+        return {
+            "word": homonym["word"],
+            "model_response": model_response,
+            "evaluation": evaluation,
+            "avg_google_ngrams_frequency": homonym["avg_google_ngrams_frequency"]
+        }
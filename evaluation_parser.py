@@ -1,40 +1,198 @@
+import os
+import threading
+import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
 
 import numpy as np
-from datasets import load_dataset
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from nltk.corpus import wordnet as wn
 from tqdm import tqdm
 
+from cache import EmbeddingCache
+from checkpoint import dataset_revision
 from config import Config, Credentials
-from reader import JSONLineReader
+from gloss_matrix import GlossMatrix
+from reader import JSONLineReader, JSONReader
+from sense_index import SenseIndex
+
+# Arguments of SentenceTransformer for each embedding backend. The onnx backends need the onnx extra,
+# pip install "sentence-transformers[onnx]", and use the ONNX exports of the model repository.
+EMBEDDING_BACKENDS = {
+    'torch': {},
+    'onnx': {'backend': 'onnx'},
+    'onnx-int8': {'backend': 'onnx', 'model_kwargs': {'file_name': 'onnx/model_qint8_avx2.onnx'}},
+}
+
+# Models and word maps shared by all parsers of a process. The heavy libraries are only imported on
+# first use, so a parser that does not add WordNet rankings starts without them.
+_sim_models = {}
+_word_to_results = {}
+_lock = threading.Lock()
+
+
+def get_sim_model(model_name: str, backend: str = 'torch'):
+    """Return the SentenceTransformer of this process for model_name and backend, loading it on first use."""
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}, choose one of {list(EMBEDDING_BACKENDS)}")
+    with _lock:
+        if (model_name, backend) not in _sim_models:
+            from sentence_transformers import SentenceTransformer
+            _sim_models[model_name, backend] = SentenceTransformer(model_name, **EMBEDDING_BACKENDS[backend])
+        return _sim_models[model_name, backend]
+
+
+def get_word_to_result(dataset: str = 'homonymy', refresh: bool = False) -> dict[str, dict]:
+    """
+    Return the coarse synsets of each word of a dataset, shared by all parsers of this process.
+
+    The map is read from a local snapshot in Config.WORD_SNAPSHOT_DIR. The snapshot only keeps the
+    fields the parser needs and records the revision of the HF dataset it was written from. The
+    revision is looked up at most every Config.WORD_SNAPSHOT_MAX_AGE seconds, and the snapshot is
+    rebuilt when the dataset has a new revision or refresh is passed. If the revision can't be looked
+    up, e.g. offline, the snapshot is used as is.
+    """
+    with _lock:
+        if dataset in _word_to_results and not refresh:
+            return _word_to_results[dataset]
+
+        repo_id = Config.DATASETS[dataset]
+        snapshot_file = os.path.join(Config.WORD_SNAPSHOT_DIR, f"{dataset}.json")
+        snapshot = JSONReader().read(snapshot_file) if os.path.exists(snapshot_file) and not refresh else {}
+        # The mtime of the snapshot is the time its revision was last confirmed.
+        if 'words' in snapshot and time.time() - os.path.getmtime(snapshot_file) < Config.WORD_SNAPSHOT_MAX_AGE:
+            revision = snapshot.get('revision')
+        else:
+            revision = dataset_revision(repo_id)
+            if 'words' in snapshot and revision is not None and snapshot.get('revision') == revision:
+                os.utime(snapshot_file)
+
+        if 'words' in snapshot and (revision is None or snapshot.get('revision') == revision):
+            word_to_result = snapshot['words']
+        else:
+            from datasets import load_dataset
+            print(f"Writing the word snapshot of {repo_id} at revision {revision}")
+            entries = load_dataset(repo_id, revision=revision, token=Credentials.hf_api_key)['train']
+            word_to_result = {
+                entry['word']: {'coarse_synsets': [
+                    {'name': coarse_synset['name'],
+                     'synsets': [{'name': synset['name']} for synset in coarse_synset.get('synsets') or []]}
+                    for coarse_synset in entry['coarse_synsets']
+                ]}
+                for entry in entries
+            }
+            os.makedirs(Config.WORD_SNAPSHOT_DIR, exist_ok=True)
+            JSONReader().write(snapshot_file, {'revision': revision, 'words': word_to_result}, mode='w')
+        _word_to_results[dataset] = word_to_result
+        return word_to_result
 
 
 class EvaluationParser:
-    def __init__(self):
-        self.sim_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-        dataset = load_dataset(Config.DATASETS['homonymy'], token=Credentials.hf_api_key)['train']
-        self.word_to_result = {entry['word']: entry for entry in dataset}
+    SIM_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+    ENCODE_BATCH_SIZE = 256
+    # Minimal cosine similarity of a definition to its closest WordNet gloss to count as a match.
+    MIN_SIMILARITY = 0.4
+
+    def __init__(self, embedding_backend: str = Config.EMBEDDING_BACKEND):
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {embedding_backend}, "
+                             f"choose one of {list(EMBEDDING_BACKENDS)}")
+        self.embedding_backend = embedding_backend
+
+    @property
+    def embedding_model(self) -> str:
+        """Name of the embeddings in the caches, embeddings of other backends than torch differ slightly."""
+        if self.embedding_backend == 'torch':
+            return self.SIM_MODEL_NAME
+        return f"{self.SIM_MODEL_NAME}@{self.embedding_backend}"
+
+    # All resources are loaded on first use, parsing without WordNet rankings needs none of them.
+    @cached_property
+    def sim_model(self):
+        return get_sim_model(self.SIM_MODEL_NAME, self.embedding_backend)
+
+    @cached_property
+    def word_to_result(self) -> dict[str, dict]:
+        return get_word_to_result('homonymy')
+
+    @cached_property
+    def gloss_cache(self) -> EmbeddingCache:
+        return EmbeddingCache(Config.EMBEDDING_CACHE_FILE)
+
+    @cached_property
+    def gloss_matrix(self) -> GlossMatrix | None:
+        # None until built with gloss_matrix.py, the glosses are then embedded on demand.
+        return GlossMatrix.open(self.embedding_model)
+
+    @cached_property
+    def sense_index(self) -> SenseIndex | None:
+        return SenseIndex.open(self.embedding_model)
+
+    def parse_evaluation(self, file_in: str, file_out: str, add_wordnet: bool = True, top_senses: int = 0):
+        parsed_results = self.parse_results(file_in)
+        if add_wordnet:
+            parsed_results = self.add_wordnet_rankings(parsed_results, top_senses)
+        JSONLineReader().write(file_out, parsed_results)
+        return parsed_results
+
+    def parse_evaluations(self, files: list[tuple[str, str]], add_wordnet: bool = True, top_senses: int = 0,
+                          workers: int | None = None) -> list[list[dict]]:
+        """
+        Parse several files with the model and dataset of this parser.
 
-    def parse_evaluation(self, file_in: str, file_out: str, add_wordnet: bool = True):
-        results = JSONLineReader().read(file_in)
+        The judge evaluations of the files are parsed in a process pool, the WordNet rankings of all
+        files are then added in one batched pass and every file is written to its output file.
+
+        :param files: Pairs of input and output file.
+        :param workers: Number of processes, one per file up to the number of CPUs if None.
+        :return: The parsed results of each file.
+        """
+        start = time.perf_counter()
+        workers = workers or min(len(files), os.cpu_count() or 1) or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed = list(executor.map(self._parse_results_timed, [file_in for file_in, _ in files]))
+        all_results = [parsed_result for parsed_results, _ in parsed for parsed_result in parsed_results]
+
+        ranking_seconds = 0.0
+        if add_wordnet:
+            ranking_start = time.perf_counter()
+            self.add_wordnet_rankings(all_results, top_senses)
+            ranking_seconds = time.perf_counter() - ranking_start
+
+        for (file_in, file_out), (parsed_results, seconds) in zip(files, parsed):
+            JSONLineReader().write(file_out, parsed_results)
+            print(f"{file_in}: {len(parsed_results)} results parsed in {seconds:.2f}s "
+                  f"({len(parsed_results) / seconds if seconds else 0:.0f} results/s)")
+
+        if add_wordnet:
+            definitions = sum(len(result.get('definitions')) for result in all_results)
+            print(f"Ranked {definitions} definitions of {len(files)} files in {ranking_seconds:.2f}s "
+                  f"({definitions / ranking_seconds if ranking_seconds else 0:.0f} definitions/s)")
+        print(f"Parsed {len(all_results)} results of {len(files)} files with {workers} processes "
+              f"in {time.perf_counter() - start:.2f}s")
+        return [parsed_results for parsed_results, _ in parsed]
+
+    @classmethod
+    def _parse_results_timed(cls, file_in: str) -> tuple[list[dict], float]:
+        start = time.perf_counter()
+        parsed_results = cls.parse_results(file_in, progress=False)
+        return parsed_results, time.perf_counter() - start
+
+    @classmethod
+    def parse_results(cls, file_in: str, progress: bool = True) -> list[dict]:
+        """Parse the judge evaluations of a file, without the WordNet rankings."""
         parsed_results = []
-        for result in tqdm(results):
+        for result in tqdm(JSONLineReader(on_error='warn').iter(file_in), disable=not progress):
             parsed_result = result
             try:
-                parsed_result = self.parse_definitions(parsed_result)
+                parsed_result = cls.parse_definitions(parsed_result)
             except AssertionError:
                 print(f'{parsed_result['word']} - amount of definitions does not match selected category')
                 continue
 
-            parsed_result = self.parse_category(parsed_result)
-            parsed_result = self.parse_context(parsed_result)
-            if add_wordnet:
-                parsed_result = self.add_wordnet_ranking(result)
+            parsed_result = cls.parse_category(parsed_result)
+            parsed_result = cls.parse_context(parsed_result)
             del parsed_result['evaluation']
             parsed_results.append(parsed_result)
-        JSONLineReader().write(file_out, parsed_results)
         return parsed_results
 
     @staticmethod
@@ -73,24 +231,96 @@ class EvaluationParser:
             result['category'] = category
         return result
 
-    def add_wordnet_ranking(self, result: dict) -> dict:
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.sim_model.encode(texts, batch_size=self.ENCODE_BATCH_SIZE)
+
+    def gloss_embeddings(self, synsets: list) -> dict[str, np.ndarray]:
+        """Embeddings of the glosses of the synsets by synset name, only glosses missing in the cache are encoded."""
+        synsets = {synset.name(): synset for synset in synsets}
+        embeddings = self.gloss_cache.get_many(self.embedding_model, list(synsets))
+        missing = [synset for name, synset in synsets.items() if name not in embeddings]
+        if missing:
+            encoded = dict(zip((synset.name() for synset in missing),
+                               self.encode([synset.definition() for synset in missing])))
+            self.gloss_cache.set_many(self.embedding_model, encoded)
+            embeddings.update(encoded)
+        return embeddings
+
+    def add_wordnet_rankings(self, results: list[dict], top_senses: int = 0) -> list[dict]:
+        """
+        Add the WordNet ranking of the definitions of all results.
+
+        The definitions of all results are encoded in one batched call. Words of the gloss matrix are
+        ranked together in one matrix product, the others against the cached gloss embeddings.
+
+        :param top_senses: If set, also add the top_senses closest senses of any lemma to each definition as
+                           wordnet_top_senses, a list of [synset name, similarity] per definition.
+        """
+        from nltk.corpus import wordnet as wn
+
+        definitions = [definition for result in results for definition in result.get('definitions')]
+        definition_embeddings = self.encode(definitions) if definitions else np.empty((0, 0))
+        bounds = np.cumsum([0] + [len(result.get('definitions')) for result in results])
+        result_embeddings = [definition_embeddings[bounds[i]:bounds[i + 1]] for i in range(len(results))]
+
+        indexed = [i for i, result in enumerate(results)
+                   if self.gloss_matrix is not None and result.get('word') in self.gloss_matrix]
+        if indexed:
+            words = [results[i].get('word') for i in indexed]
+            rankings = self.gloss_matrix.rank(words, [result_embeddings[i] for i in indexed], self.MIN_SIMILARITY)
+            for i, word, wn_rankings in zip(indexed, words, rankings):
+                results[i]['wordnet_rankings'] = wn_rankings
+                self.add_coarse_coverage(results[i], self.gloss_matrix.word_synset_names(word))
+
+        remaining = sorted(set(range(len(results))) - set(indexed))
+        word_synsets = {results[i].get('word'): wn.synsets(results[i].get('word').replace(' ', '_'), pos='n')
+                        for i in remaining}
+        gloss_embeddings = self.gloss_embeddings([synset for synsets in word_synsets.values() for synset in synsets])
+        for i in remaining:
+            synsets = word_synsets[results[i].get('word')]
+            self.add_wordnet_ranking(results[i], result_embeddings[i],
+                                     [gloss_embeddings[synset.name()] for synset in synsets])
+
+        if top_senses:
+            if self.sense_index is None:
+                print("No sense index built, run sense_index.py to add the top senses.")
+            else:
+                senses = self.sense_index.top_k_senses(definition_embeddings, k=top_senses)
+                for i, result in enumerate(results):
+                    result['wordnet_top_senses'] = [[[name, round(similarity, 4)] for name, similarity in definition]
+                                                    for definition in senses[bounds[i]:bounds[i + 1]]]
+        return results
+
+    def add_wordnet_ranking(self, result: dict, definition_embeddings: np.ndarray | None = None,
+                            wn_embeddings: list[np.ndarray] | None = None) -> dict:
+        """
+        Add the WordNet ranking and coarse synset coverage of the definitions of one result.
+
+        :param definition_embeddings: Embeddings of the definitions, encoded if None.
+        :param wn_embeddings: Embeddings of the glosses of the noun synsets of the word, taken from the
+                              gloss cache if None.
+        """
+        from nltk.corpus import wordnet as wn
+        from sklearn.metrics.pairwise import cosine_similarity
+
         word = result.get('word')
         definitions = result.get('definitions')
-        wn_definitions = [{'name': synset.name(), 'definition': synset.definition()} for synset in wn.synsets(word.replace(' ', '_'), pos='n')]
+        wn_synsets = wn.synsets(word.replace(' ', '_'), pos='n')
+        wn_definitions = [{'name': synset.name(), 'definition': synset.definition()} for synset in wn_synsets]
+        if definition_embeddings is None:
+            definition_embeddings = self.encode(definitions) if definitions else np.empty((0, 0))
+        if wn_embeddings is None:
+            gloss_embeddings = self.gloss_embeddings(wn_synsets)
+            wn_embeddings = [gloss_embeddings[synset.name()] for synset in wn_synsets]
 
         wn_rankings = []
-        all_similarities = []  # to store similarities for each definition
-
-        for definition in definitions:
-            all_definitions = [definition] + [wn_def.get('definition') for wn_def in wn_definitions]
-            embeddings = self.sim_model.encode(all_definitions)
-            def_embedding = embeddings[0]
-            wn_embeddings = embeddings[1:]
-            similarities = cosine_similarity([def_embedding], wn_embeddings)[0]
-
-            max_sim = np.max(similarities)
-            wn_rankings.append(np.argmax(similarities).item() if max_sim > 0.4 else -1)
-            all_similarities.append(similarities)
+        if len(definitions) and wn_embeddings:
+            similarities = cosine_similarity(definition_embeddings, np.stack(wn_embeddings))
+            max_sims = np.max(similarities, axis=1)
+            wn_rankings = [ranking if max_sim > self.MIN_SIMILARITY else -1
+                           for ranking, max_sim in zip(np.argmax(similarities, axis=1).tolist(), max_sims)]
+        elif len(definitions):
+            wn_rankings = [-1] * len(definitions)
 
         result['wordnet_rankings'] = wn_rankings
 
@@ -99,7 +329,7 @@ class EvaluationParser:
         # for i, wn_idx in enumerate(wn_rankings):
         #     if wn_idx == -1:
         #         continue
-        #     sim = all_similarities[i][wn_idx]
+        #     sim = similarities[i][wn_idx]
         #     wn_to_defs.setdefault(wn_idx, []).append((i, sim))
         #
         # # Step 2: keep only best-matching definition per wn sense
@@ -124,19 +354,23 @@ class EvaluationParser:
         #     result['category'] = 'One'
 
 
-        coarse_synsets = self.word_to_result.get(word, {}).get('coarse_synsets')
+        return self.add_coarse_coverage(result, [wn_definition['name'] for wn_definition in wn_definitions])
+
+    def add_coarse_coverage(self, result: dict, synset_names: list[str]) -> dict:
+        """Add the share of coarse synsets of the word matched by the wordnet_rankings of the result."""
+        coarse_synsets = self.word_to_result.get(result.get('word'), {}).get('coarse_synsets')
         covered = set()
-        for wn_ranking in wn_rankings:
+        for wn_ranking in result['wordnet_rankings']:
             if wn_ranking == -1:
                 continue
 
-            matched_synset = wn_definitions[wn_ranking]
+            matched_synset_name = synset_names[wn_ranking]
             for coarse_synset in coarse_synsets:
                 if coarse_synset['name'] in covered:
                     continue
 
                 for synset in coarse_synset.get('synsets', []):
-                    if synset.get('name') == matched_synset.get('name'):
+                    if synset.get('name') == matched_synset_name:
                         covered.add(coarse_synset['name'])
                         break
         result['coarse_synsets_covered'] = round(len(covered) / len(coarse_synsets), 2)
@@ -0,0 +1,195 @@
+"""
+Local fake of the OpenAI Files and Batch API for trying out batch jobs without cost.
+
+Batches complete after a few polls and answer every request with an echo of its last message.
+Failures can be injected: failure_rate fails requests with a server error and expire_rate lets
+batches expire with only half of their requests processed. Both only hit the first submission of
+a request, so resubmissions succeed.
+
+    python fake_batch_server.py --port 8089 --failure-rate 0.1 --expire-rate 0.2
+    python batch_orchestrator.py jobs.json --base-url http://localhost:8089/v1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeBatchBackend:
+    """In-memory files and batches of the fake server."""
+
+    def __init__(self, polls_to_complete: int = 2, failure_rate: float = 0.0, expire_rate: float = 0.0,
+                 seed: int = 42):
+        self.polls_to_complete = polls_to_complete
+        self.failure_rate = failure_rate
+        self.expire_rate = expire_rate
+        self.random = random.Random(seed)
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.polls: dict[str, int] = {}
+        self.seen_custom_ids: set[str] = set()
+        self.lock = threading.Lock()
+
+    def create_file(self, filename: str, content: bytes, purpose: str = 'batch') -> dict:
+        with self.lock:
+            file_id = f"file-{uuid.uuid4().hex}"
+            self.files[file_id] = content
+        return {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                'filename': filename, 'purpose': purpose, 'status': 'processed'}
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> dict:
+        with self.lock:
+            batch_id = f"batch_{uuid.uuid4().hex}"
+            total = len([line for line in self.files[input_file_id].splitlines() if line.strip()])
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': endpoint, 'input_file_id': input_file_id,
+                'completion_window': completion_window, 'status': 'validating', 'created_at': int(time.time()),
+                'output_file_id': None, 'error_file_id': None,
+                'request_counts': {'total': total, 'completed': 0, 'failed': 0},
+            }
+            self.polls[batch_id] = 0
+            return dict(self.batches[batch_id])
+
+    def retrieve_batch(self, batch_id: str) -> dict:
+        with self.lock:
+            batch = self.batches[batch_id]
+            self.polls[batch_id] += 1
+            if batch['status'] in ('validating', 'in_progress'):
+                if self.polls[batch_id] >= self.polls_to_complete:
+                    self._finish(batch)
+                else:
+                    batch['status'] = 'in_progress'
+            return dict(batch)
+
+    def _finish(self, batch: dict):
+        tasks = [json.loads(line) for line in self.files[batch['input_file_id']].splitlines() if line.strip()]
+        first_submission = [task['custom_id'] not in self.seen_custom_ids for task in tasks]
+        self.seen_custom_ids.update(task['custom_id'] for task in tasks)
+
+        expired = all(first_submission) and self.random.random() < self.expire_rate
+        if expired:
+            tasks = tasks[:len(tasks) // 2]
+
+        outputs, errors = [], []
+        for task, first in zip(tasks, first_submission):
+            if first and self.random.random() < self.failure_rate:
+                errors.append({'id': f"batch_req_{uuid.uuid4().hex}", 'custom_id': task['custom_id'],
+                               'response': {'status_code': 500, 'request_id': uuid.uuid4().hex,
+                                            'body': {'error': {'message': 'Injected failure'}}},
+                               'error': None})
+            else:
+                outputs.append({'id': f"batch_req_{uuid.uuid4().hex}", 'custom_id': task['custom_id'],
+                                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex,
+                                             'body': self._response_body(task)},
+                                'error': None})
+
+        if outputs:
+            batch['output_file_id'] = self._store_lines(outputs)
+        if errors:
+            batch['error_file_id'] = self._store_lines(errors)
+        batch['status'] = 'expired' if expired else 'completed'
+        batch['request_counts'] = {'total': batch['request_counts']['total'], 'completed': len(outputs),
+                                   'failed': len(errors)}
+
+    def _store_lines(self, lines: list[dict]) -> str:
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines).encode('utf-8')
+        return file_id
+
+    @staticmethod
+    def _response_body(task: dict) -> dict:
+        body = task.get('body', {})
+        messages = body.get('messages') or body.get('input') or [{}]
+        content = f"Echo: {messages[-1].get('content', '')}"
+        if task.get('url') == '/v1/responses':
+            return {'object': 'response', 'model': body.get('model'),
+                    'output': [{'type': 'message', 'role': 'assistant',
+                                'content': [{'type': 'output_text', 'text': content}]}]}
+        return {'object': 'chat.completion', 'model': body.get('model'),
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': content}}]}
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    backend: FakeBatchBackend
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.endswith('/files'):
+            fields = self._parse_multipart(body)
+            self._send(self.backend.create_file(fields['file'][0], fields['file'][1], fields['purpose'][1].decode()))
+        elif self.path.endswith('/batches'):
+            payload = json.loads(body)
+            self._send(self.backend.create_batch(payload['input_file_id'], payload['endpoint'],
+                                                 payload['completion_window']))
+        else:
+            self._send({'error': {'message': f'Unknown path {self.path}'}}, status=404)
+
+    def do_GET(self):
+        if match := re.search(r'/batches/([^/]+)$', self.path):
+            self._send(self.backend.retrieve_batch(match.group(1)))
+        elif match := re.search(r'/files/([^/]+)/content$', self.path):
+            self._send_bytes(self.backend.files[match.group(1)])
+        else:
+            self._send({'error': {'message': f'Unknown path {self.path}'}}, status=404)
+
+    def _parse_multipart(self, body: bytes) -> dict[str, tuple[str | None, bytes]]:
+        header = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+        message = BytesParser(policy=HTTP).parsebytes(header + body)
+        return {part.get_param('name', header='content-disposition'): (part.get_filename(),
+                                                                       part.get_payload(decode=True))
+                for part in message.iter_parts()}
+
+    def _send(self, payload: dict, status: int = 200):
+        self._send_bytes(json.dumps(payload).encode('utf-8'), status, 'application/json')
+
+    def _send_bytes(self, content: bytes, status: int = 200, content_type: str = 'application/octet-stream'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_batch_server(port: int = 0, **backend_kwargs) -> tuple[ThreadingHTTPServer, str]:
+    """
+    Start the fake server in a background thread.
+
+    :param port: Port to listen on, 0 picks a free one.
+    :param backend_kwargs: Arguments of FakeBatchBackend.
+    :return: The server, call shutdown() to stop it, and its base url.
+    """
+    handler = type('Handler', (FakeBatchHandler,), {'backend': FakeBatchBackend(**backend_kwargs)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake of the OpenAI Batch API.")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--polls-to-complete', type=int, default=2)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--expire-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, base_url = start_fake_batch_server(args.port, polls_to_complete=args.polls_to_complete,
+                                               failure_rate=args.failure_rate, expire_rate=args.expire_rate)
+    print(f"Fake batch server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Module for the precomputed WordNet noun-gloss embedding matrix.
+
+The normalized embeddings of the glosses of the noun synsets of every dataset word are stored as one
+.npy matrix, which is opened memory-mapped. The rows of a word are contiguous and in the order of
+wn.synsets(word, pos='n'), so the row offset within a word's range is its WordNet ranking.
+
+Build it once per embedding model with `python gloss_matrix.py`.
+"""
+import argparse
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from config import Config
+from reader import JSONReader
+
+
+def model_slug(model_name: str) -> str:
+    return model_name.replace('/', '--')
+
+
+class GlossMatrix:
+    """
+    Memory-mapped gloss embeddings with a word to row range index.
+
+    :param matrix: Normalized gloss embeddings, one row per synset of each word.
+    :param words: Word to [start, end) row range.
+    :param synset_names: Synset name of each row.
+    """
+
+    def __init__(self, matrix: np.ndarray, words: dict[str, list[int]], synset_names: list[str]):
+        self.matrix = matrix
+        self.words = words
+        self.synset_names = synset_names
+
+    @staticmethod
+    def paths(model_name: str, directory: str = Config.GLOSS_MATRIX_DIR) -> tuple[str, str]:
+        """Paths of the matrix and its index for an embedding model."""
+        base = os.path.join(directory, model_slug(model_name))
+        return f"{base}.npy", f"{base}.index.json"
+
+    @classmethod
+    def open(cls, model_name: str, directory: str = Config.GLOSS_MATRIX_DIR) -> 'GlossMatrix | None':
+        """Open the matrix of an embedding model memory-mapped, None if it was not built."""
+        matrix_file, index_file = cls.paths(model_name, directory)
+        if not (os.path.exists(matrix_file) and os.path.exists(index_file)):
+            return None
+        index = JSONReader().read(index_file)
+        return cls(np.load(matrix_file, mmap_mode='r'), index['words'], index['synset_names'])
+
+    @classmethod
+    def build(cls, word_synsets: dict[str, list], embed, model_name: str,
+              directory: str = Config.GLOSS_MATRIX_DIR, dtype: str = 'float32') -> 'GlossMatrix':
+        """
+        Build and save the matrix.
+
+        :param word_synsets: Noun synsets of each word in WordNet order.
+        :param embed: Function returning the gloss embeddings of a list of synsets by synset name.
+        :param dtype: float32 or float16, float16 halves the size at a small loss of precision.
+        """
+        words, synset_names = {}, []
+        for word, synsets in word_synsets.items():
+            words[word] = [len(synset_names), len(synset_names) + len(synsets)]
+            synset_names.extend(synset.name() for synset in synsets)
+
+        embeddings = embed([synset for synsets in word_synsets.values() for synset in synsets])
+        matrix = np.stack([embeddings[name] for name in synset_names]) if synset_names else np.empty((0, 0))
+        matrix = normalize(matrix).astype(dtype)
+
+        matrix_file, index_file = cls.paths(model_name, directory)
+        os.makedirs(directory, exist_ok=True)
+        np.save(matrix_file, matrix)
+        JSONReader().write(index_file, {'model': model_name, 'dtype': dtype, 'words': words,
+                                        'synset_names': synset_names}, mode='w')
+        return cls.open(model_name, directory)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def word_synset_names(self, word: str) -> list[str]:
+        start, end = self.words[word]
+        return self.synset_names[start:end]
+
+    def rank(self, words: list[str], definition_embeddings: list[np.ndarray], min_similarity: float) -> list[list[int]]:
+        """
+        Rank the definitions of several words against their glosses, with one matrix product per distinct word.
+
+        :param words: Indexed words.
+        :param definition_embeddings: Embeddings of the definitions of each word.
+        :param min_similarity: Definitions whose best cosine similarity is not above it get -1.
+        :return: Per word the WordNet ranking of each definition.
+        """
+        counts = [len(embeddings) for embeddings in definition_embeddings]
+        rankings = [[-1] * count for count in counts]
+
+        # Results of the same word share the gloss block, so its rows are read and multiplied once.
+        word_results = defaultdict(list)
+        for idx, (word, count) in enumerate(zip(words, counts)):
+            if count:
+                word_results[word].append(idx)
+
+        for word, indices in word_results.items():
+            start, end = self.words[word]
+            if start == end:
+                continue
+            definitions = normalize(np.concatenate([definition_embeddings[idx] for idx in indices]))
+            similarities = definitions @ np.asarray(self.matrix[start:end], dtype=np.float32).T
+            best = np.argmax(similarities, axis=1)
+            max_sims = similarities[np.arange(len(best)), best]
+            word_rankings = np.where(max_sims > min_similarity, best, -1).tolist()
+
+            offset = 0
+            for idx in indices:
+                rankings[idx] = word_rankings[offset:offset + counts[idx]]
+                offset += counts[idx]
+        return rankings
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if not embeddings.size:
+        return embeddings
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def main():
+    from datasets import load_dataset
+    from nltk.corpus import wordnet as wn
+
+    from config import Credentials
+    from evaluation_parser import EvaluationParser
+
+    parser = argparse.ArgumentParser(description="Build the WordNet noun-gloss embedding matrix of the dataset words.")
+    parser.add_argument('--datasets', nargs='+', default=['homonymy'], choices=list(Config.DATASETS))
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--directory', default=Config.GLOSS_MATRIX_DIR)
+    parser.add_argument('--embedding-backend', default=Config.EMBEDDING_BACKEND)
+    args = parser.parse_args()
+
+    evaluation_parser = EvaluationParser(args.embedding_backend)
+    words = dict.fromkeys(entry['word'] for name in args.datasets
+                          for entry in load_dataset(Config.DATASETS[name], token=Credentials.hf_api_key)['train'])
+    word_synsets = {word: wn.synsets(word.replace(' ', '_'), pos='n') for word in words}
+    matrix = GlossMatrix.build(word_synsets, evaluation_parser.gloss_embeddings, evaluation_parser.embedding_model,
+                               args.directory, args.dtype)
+    print(f"Built gloss matrix of {len(matrix.words)} words with {matrix.matrix.shape[0]} rows in {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
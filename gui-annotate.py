@@ -3,7 +3,6 @@ import re
 import click
 import questionary
 from reader import JSONLineReader
-import random
 from sklearn.metrics import cohen_kappa_score
 
 # Options for annotations
@@ -12,13 +11,15 @@ VALID_REMARK = ["True", "False"]
 VALID_CONTEXT_REQ = ["True", "False"]
 
 
-def sample_evaluations(evaluations: list[dict], sample_size: int) -> list[dict]:
-    """Randomly sample up to sample_size evaluations."""
-    if len(evaluations) <= sample_size:
-        click.echo(f"Only {len(evaluations)} evaluations available; using all.")
-        return evaluations
-    random.seed(40)  # For reproducibility
-    return random.sample(evaluations, sample_size)
+def sample_evaluations(input_file: str, sample_size: int) -> list[dict]:
+    """Randomly sample up to sample_size evaluations, only the sampled lines are parsed."""
+    reader = JSONLineReader()
+    count = reader.count(input_file)
+    click.echo(f"Loaded {count} evaluations.")
+    if count <= sample_size:
+        click.echo(f"Only {count} evaluations available; using all.")
+        return list(reader.iter(input_file))
+    return reader.sample(input_file, sample_size, seed=40)  # For reproducibility
 
 def save_annotated_evaluations(annotated: list[dict], output_file: str):
     """Save human-annotated evaluations to JSONL."""
@@ -83,12 +84,8 @@ def cli():
 @click.option('--sample-size', default=20, type=int, help='Number of evaluations to sample.')
 def annotate_responses(input, output, sample_size):
     """Annotate a sample of evaluations and calculate correlation."""
-    # Load evaluations
-    responses = JSONLineReader().read(input)
-    click.echo(f"Loaded {len(responses)} evaluations.")
-
     # Sample evaluations
-    sampled_evaluations = sample_evaluations(responses, sample_size)
+    sampled_evaluations = sample_evaluations(input, sample_size)
     click.echo(f"Sampled {len(sampled_evaluations)} evaluations for annotation.")
 
     # Annotate each sample
@@ -146,12 +143,8 @@ def annotate_responses(input, output, sample_size):
 @click.option('--sample-size', default=20, type=int, help='Number of evaluations to sample.')
 def annotate(input, output, sample_size):
     """Annotate a sample of evaluations and calculate correlation."""
-    # Load evaluations
-    evaluations = JSONLineReader().read(input)
-    click.echo(f"Loaded {len(evaluations)} evaluations.")
-
     # Sample evaluations
-    sampled_evaluations = sample_evaluations(evaluations, sample_size)
+    sampled_evaluations = sample_evaluations(input, sample_size)
     click.echo(f"Sampled {len(sampled_evaluations)} evaluations for annotation.")
 
     # Annotate each sample
@@ -233,10 +226,8 @@ def calculate_human(files, human_files):
 
     for human_file, file in zip(human_files, files):
         human_evaluations = reader.read(human_file)
-        auto_evaluations = reader.read(file)
-        auto_evaluations = {entry['word']: entry for entry in auto_evaluations}
         for evaluation in human_evaluations:
-            auto_evaluation = auto_evaluations.get(evaluation['word'])
+            auto_evaluation = reader.read_by_key(file, 'word', evaluation['word'])
             if not auto_evaluation:
                 continue
             all_evaluations.append({**evaluation, 'automatic_evaluation': {'category': auto_evaluation.get('category'),
@@ -0,0 +1,67 @@
+"""Module for pooled HTTP sessions shared by the clients of a process."""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config, HttpConfig
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions: dict[tuple[int, HttpConfig], requests.Session] = {}
+_lock = threading.Lock()
+
+
+class MinBackoffRetry(Retry):
+    """Retry that waits at least min_backoff seconds between attempts unless the server sends Retry-After."""
+
+    def __init__(self, *args, min_backoff: float = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.min_backoff = min_backoff
+
+    def new(self, **kwargs) -> 'MinBackoffRetry':
+        kwargs.setdefault('min_backoff', self.min_backoff)
+        return super().new(**kwargs)
+
+    def get_backoff_time(self) -> float:
+        return max(self.min_backoff, super().get_backoff_time())
+
+
+def create_session(config: HttpConfig) -> requests.Session:
+    """
+    Create a session keeping connections alive in a pool per host.
+
+    pool_connections is the number of hosts a pool is kept for, pool_maxsize the number of connections
+    per host. Requests wait for a free connection instead of opening more than pool_maxsize. Connection
+    errors and the RETRY_STATUSES are retried with exponential backoff of at least min_backoff seconds,
+    respecting Retry-After.
+    """
+    retry = MinBackoffRetry(
+        total=config.max_retries,
+        backoff_factor=config.backoff_factor,
+        min_backoff=config.min_backoff,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=None,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize,
+                          max_retries=retry, pool_block=True)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(config: HttpConfig | None = None) -> requests.Session:
+    """Return the session of this process for config, creating it on first use."""
+    config = config or Config.HTTP_CONFIG
+    # Sessions must not be shared with forked worker processes.
+    key = (os.getpid(), config)
+    with _lock:
+        if key not in _sessions:
+            _sessions[key] = create_session(config)
+        return _sessions[key]
+
@@ -0,0 +1,92 @@
+"""Module for recording the streaming latency of LLM calls."""
+import statistics
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+# Upper bounds of the histogram buckets in milliseconds.
+HISTOGRAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+HISTOGRAM_WIDTH = 40
+
+
+@dataclass
+class CallLatency:
+    """Latency of one streamed call, all times in seconds."""
+    time_to_first_token: float
+    total_seconds: float
+    tokens: int
+    inter_token_latencies: list[float] = field(default_factory=list)
+
+    @property
+    def tokens_per_second(self) -> float:
+        decode_seconds = self.total_seconds - self.time_to_first_token
+        return (self.tokens - 1) / decode_seconds if self.tokens > 1 and decode_seconds > 0 else 0.0
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Return the q-th percentile (0-100) of values."""
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method='inclusive')[min(98, max(0, round(q) - 1))]
+
+
+def format_histogram(title: str, seconds: list[float]) -> str:
+    """Render a text histogram of latencies over HISTOGRAM_BUCKETS_MS."""
+    counts = [0] * len(HISTOGRAM_BUCKETS_MS)
+    for value in seconds:
+        for idx, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+            if value * 1000 <= bound:
+                counts[idx] += 1
+                break
+
+    lines = [f"  {title} (n={len(seconds)}, p50={percentile(seconds, 50) * 1000:.0f}ms, "
+             f"p95={percentile(seconds, 95) * 1000:.0f}ms)"]
+    largest = max(counts, default=0) or 1
+    for bound, count in zip(HISTOGRAM_BUCKETS_MS, counts):
+        label = f"<= {bound:g}ms" if bound != float('inf') else "> 10000ms"
+        bar = '#' * round(count / largest * HISTOGRAM_WIDTH)
+        lines.append(f"    {label:>10} | {bar} {count}")
+    return '\n'.join(lines)
+
+
+class LatencyRecorder:
+    """Collect the latencies of streamed calls per model and report them as histograms."""
+
+    def __init__(self):
+        self.calls: dict[str, list[CallLatency]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency: CallLatency):
+        with self._lock:
+            self.calls[model].append(latency)
+
+    def pop_calls(self) -> dict[str, list[CallLatency]]:
+        """Return the recorded calls and clear them, e.g. to pass them from a worker process to the main one."""
+        with self._lock:
+            calls, self.calls = dict(self.calls), defaultdict(list)
+        return calls
+
+    def __bool__(self) -> bool:
+        return bool(self.calls)
+
+    def report(self) -> str:
+        """Return the TTFT and inter-token latency histograms and token throughput of every model."""
+        sections = []
+        with self._lock:
+            calls = {model: list(latencies) for model, latencies in self.calls.items()}
+
+        for model, latencies in calls.items():
+            tokens = sum(latency.tokens for latency in latencies)
+            throughputs = [latency.tokens_per_second for latency in latencies if latency.tokens > 1]
+            inter_token = [value for latency in latencies for value in latency.inter_token_latencies]
+            sections.append('\n'.join([
+                f"{model}: {len(latencies)} calls, {tokens} tokens, "
+                f"{statistics.mean(throughputs) if throughputs else 0:.1f} tokens/s per call",
+                format_histogram("time to first token", [latency.time_to_first_token for latency in latencies]),
+                format_histogram("inter-token latency", inter_token),
+            ]))
+        return '\n'.join(sections)
+
+
+# Recorder shared by all clients of the process.
+LATENCY_RECORDER = LatencyRecorder()
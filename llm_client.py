@@ -1,66 +1,268 @@
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterator
+from functools import cached_property
+import threading
+import time
 import openai
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaState
 from openai.types import Batch, FileObject
-import requests
 import os
 
+from cache import CacheMissError, DiskCache, make_key
 from config import Config, LLMConfig
+from http_session import get_session
+from latency_metrics import LATENCY_RECORDER, CallLatency
+from rate_limit import RateLimiter
 from reader import JSONLineReader
 
 
 class LLMClient(ABC):
+    # Upper bound for parallel define_term calls, None if the provider has no limit.
+    max_concurrency: int | None = None
+    # Fixed decoding parameters of the provider call, part of the response cache key.
+    DECODING_PARAMS: dict = {}
+
     def __init__(self, config: LLMConfig):
         self.model = config.model
         self.config = config
+        self.cache = None
+        self.cache_only = False
+
+    def use_cache(self, cache: DiskCache, cache_only: bool = False) -> 'LLMClient':
+        """
+        Memoize define_term in cache.
+
+        :param cache: Cache the completions are stored in.
+        :param cache_only: Raise a CacheMissError instead of calling the provider on a miss.
+        :return: The client itself.
+        """
+        self.cache = cache
+        self.cache_only = cache_only
+        return self
 
     def define_term(self, prompt: str, temperature: float = 0) -> str:
         """Generate a definition for a term."""
-        return self._call_client(prompt, temperature)
+        if self.cache is None:
+            return self._call_client(prompt, temperature)
+
+        cache_key = self._cache_key(prompt, temperature)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        if self.cache_only:
+            raise CacheMissError(f"No cached response of {self.model} for prompt: {prompt}")
+
+        response = self._call_client(prompt, temperature)
+        self.cache.set(cache_key, response)
+        return response
+
+    @property
+    def batch_size(self) -> int:
+        """Number of prompts the provider generates in one call."""
+        return 1
+
+    def define_terms(self, prompts: list[str], temperature: float = 0) -> list[str]:
+        """Generate definitions for several terms. The responses are in the order of prompts."""
+        responses = [None] * len(prompts)
+        missing = []
+        for idx, prompt in enumerate(prompts):
+            if self.cache is not None:
+                cached = self.cache.get(self._cache_key(prompt, temperature))
+                if cached is not None:
+                    responses[idx] = cached
+                    continue
+                if self.cache_only:
+                    raise CacheMissError(f"No cached response of {self.model} for prompt: {prompt}")
+            missing.append(idx)
+
+        if missing:
+            generated = self._call_client_batch([prompts[idx] for idx in missing], temperature)
+            for idx, response in zip(missing, generated):
+                responses[idx] = response
+                if self.cache is not None:
+                    self.cache.set(self._cache_key(prompts[idx], temperature), response)
+        return responses
+
+    def stream_term(self, prompt: str, temperature: float = 0) -> Iterator[str]:
+        """
+        Generate a definition for a term, yielding the response in chunks as they are generated.
+
+        The time to first token, inter-token latencies and number of tokens of the call are recorded
+        in LATENCY_RECORDER. Cached responses are yielded as a single chunk and not recorded.
+        """
+        cache_key = self._cache_key(prompt, temperature)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+            if self.cache_only:
+                raise CacheMissError(f"No cached response of {self.model} for prompt: {prompt}")
+
+        chunks = []
+        chunk_times = []
+        start = time.perf_counter()
+        for chunk in self._stream_client(prompt, temperature):
+            chunk_times.append(time.perf_counter())
+            chunks.append(chunk)
+            yield chunk
+        end = time.perf_counter()
+
+        response = ''.join(chunks)
+        if chunk_times:
+            LATENCY_RECORDER.record(self.model, CallLatency(
+                time_to_first_token=chunk_times[0] - start,
+                total_seconds=end - start,
+                tokens=self._count_tokens(response, len(chunks)),
+                inter_token_latencies=[later - earlier for earlier, later in zip(chunk_times, chunk_times[1:])],
+            ))
+        if self.cache is not None:
+            self.cache.set(cache_key, response.strip())
+
+    def _stream_client(self, prompt: str, temperature: float) -> Iterator[str]:
+        """Stream the response. Providers without streaming yield the whole response as one chunk."""
+        yield self._call_client(prompt, temperature)
+
+    def _count_tokens(self, response: str, chunks: int) -> int:
+        """Number of generated tokens. Most providers stream one token per chunk."""
+        return chunks
+
+    def _cache_key(self, prompt: str, temperature: float) -> str:
+        return make_key(type(self).__name__, self.model, temperature, self.DECODING_PARAMS, prompt)
 
     @abstractmethod
     def _call_client(self, prompt: str,temperature: float) -> str:
         """Abstract method to handle API calls for the specific provider."""
         pass
 
+    def _call_client_batch(self, prompts: list[str], temperature: float) -> list[str]:
+        """Handle several prompts. Providers without batch support are called prompt by prompt."""
+        return [self._call_client(prompt, temperature) for prompt in prompts]
+
 
 class LLamaCPPClient(LLMClient):
-    def __init__(self, config: LLMConfig):
-        super().__init__(config)
-        self.llm = Llama(
-            model_path=config.model,
+    max_concurrency = 1
+    DECODING_PARAMS = {'max_tokens': 200, 'stop': ["</s>"]}
+
+    @cached_property
+    def llm(self) -> Llama:
+        """Load the model on first use, so cached responses don't need the weights."""
+        return Llama(
+            model_path=self.config.model,
             n_gpu_layers=-1,
             n_ctx=0,
             logits_all=True,
-            n_threads=4
+            n_threads=self.config.n_threads or 4
         )
 
+    PROMPT_START = "<s>[INST] "
+    PROMPT_END = " [/INST]"
+
+    # Saved states kept at most. With logits_all a state holds the n_ctx x n_vocab scores, several GB.
+    MAX_PREFIX_STATES = 2
+
+    def __init__(self, config: LLMConfig):
+        super().__init__(config)
+        self.prompt_prefixes: set[str] = set()
+        # Least recently used first.
+        self.prefix_states: OrderedDict[str, tuple[list[int], LlamaState]] = OrderedDict()
+
+    def cache_prompt_prefix(self, prompt_prefix: str):
+        """
+        Keep the evaluated state of a prompt beginning shared by upcoming prompts.
+
+        Before each call the state of the longest matching prefix is restored, so llama.cpp only has
+        to evaluate the remaining suffix of the prompt. The prefix is evaluated on first use and the
+        states of the MAX_PREFIX_STATES most recently used prefixes are kept.
+        """
+        self.prompt_prefixes.add(f"{self.PROMPT_START}{prompt_prefix}")
+
+    def _restore_prompt_prefix(self, text: str):
+        matches = [prefix for prefix in self.prompt_prefixes if text.startswith(prefix)]
+        if not matches:
+            return
+
+        prefix = max(matches, key=len)
+        if prefix not in self.prefix_states:
+            tokens = self.llm.tokenize(prefix.encode('utf-8'), special=True)
+            self.llm.reset()
+            self.llm.eval(tokens)
+            self.prefix_states[prefix] = (tokens, self.llm.save_state())
+            while len(self.prefix_states) > self.MAX_PREFIX_STATES:
+                self.prefix_states.popitem(last=False)
+        self.prefix_states.move_to_end(prefix)
+
+        tokens, state = self.prefix_states[prefix]
+        # Otherwise llama.cpp reuses the evaluated prefix of the previous prompt by itself.
+        if self.llm.input_ids[:len(tokens)].tolist() != tokens or self.llm.n_tokens < len(tokens):
+            self.llm.load_state(state)
+
     def _call_client(self, prompt: str, temperature: float) -> str:
+        text = f"{self.PROMPT_START}{prompt}{self.PROMPT_END}"
+        self._restore_prompt_prefix(text)
         output = self.llm(
-            f"<s>[INST] {prompt} [/INST]",
-            max_tokens=200,
-            stop=["</s>"],
-            echo=False
+            text,
+            echo=False,
+            **self.DECODING_PARAMS
         )
-        return output['choices'][0]['text']
+        return output['choices'][0]['text'].strip()
+
+    def _stream_client(self, prompt: str, temperature: float) -> Iterator[str]:
+        text = f"{self.PROMPT_START}{prompt}{self.PROMPT_END}"
+        self._restore_prompt_prefix(text)
+        for chunk in self.llm(text, echo=False, stream=True, **self.DECODING_PARAMS):
+            if chunk['choices'][0]['text']:
+                yield chunk['choices'][0]['text']
 
 class OpenAIClient(LLMClient):
+    # Errors worth retrying, all others (e.g. authentication or bad requests) are raised right away.
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError,
+                        openai.InternalServerError)
+
     def __init__(self, config: LLMConfig):
         super().__init__(config)
         self.client = openai.OpenAI(base_url=config.base_url, api_key=config.api_key if config.api_key else Config.CREDENTIALS.openai_api_key)
+        self.rate_limiter = RateLimiter(requests_per_minute=config.requests_per_minute,
+                                        max_retries=config.max_retries)
 
     def _call_client(self, prompt: str,temperature: float) -> str:
+        # Retries are done by the rate limiter, which also adapts to the rate limit headers.
+        completions = self.client.with_options(max_retries=0).chat.completions
+        try:
+            raw_response = self.rate_limiter.call(
+                lambda: completions.with_raw_response.create(
+                    model=self.model,
+                    messages=self._get_messages(prompt),
+                    temperature=temperature,
+                    #seed=42,
+                ),
+                retryable=self.RETRYABLE_ERRORS,
+            )
+        except openai.OpenAIError as e:
+            print(f"Error with OpenAI {self.model}: {e}")
+            raise
+        response = raw_response.parse()
+        return response.choices[0].message.content.strip()
+
+    def _stream_client(self, prompt: str, temperature: float) -> Iterator[str]:
+        completions = self.client.with_options(max_retries=0).chat.completions
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=self._get_messages(prompt),
-                temperature=temperature,
-                #seed=42,
+            raw_response = self.rate_limiter.call(
+                lambda: completions.with_raw_response.create(
+                    model=self.model,
+                    messages=self._get_messages(prompt),
+                    temperature=temperature,
+                    stream=True,
+                ),
+                retryable=self.RETRYABLE_ERRORS,
             )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
+        except openai.OpenAIError as e:
             print(f"Error with OpenAI {self.model}: {e}")
-            return "Error: Could not process request"
+            raise
+        for chunk in raw_response.parse():
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
 
     def upload_batch_file(self, file_name: str) -> FileObject:
         """
@@ -76,23 +278,42 @@ class OpenAIClient(LLMClient):
             )
         return batch_file
 
-    def create_batch_job(self, file_name: str, endpoint="/v1/chat/completions") -> Batch:
+    def create_batch_job(self, file_name: str, endpoint="/v1/chat/completions", completion_window="24h") -> Batch:
         """
         Creates a batch job using the file at file_name and a specified endpoint.
 
         :param file_name: Path to the file to be processed in the batch job.
         :param endpoint: The API endpoint to send the batch request to. Defaults to
                          "/v1/chat/completions".
+        :param completion_window: Time frame within which the batch should be processed.
         :return: Metadata of the created batch job, including job ID.
         """
         batch_file = self.upload_batch_file(file_name)
         batch_job = self.client.batches.create(
             input_file_id=batch_file.id,
             endpoint=endpoint,
-            completion_window="24h"
+            completion_window=completion_window
         )
         return batch_job
 
+    def retrieve_batch(self, batch_id: str) -> Batch:
+        """
+        Retrieves the current metadata of a batch job.
+
+        :param batch_id: ID of the batch job.
+        :return: Metadata of the batch job, including its status and result file IDs.
+        """
+        return self.client.batches.retrieve(batch_id)
+
+    def get_file_content(self, file_id: str) -> bytes:
+        """
+        Downloads the content of a file, e.g. the output or error file of a batch job.
+
+        :param file_id: ID of the file.
+        :return: Raw content of the file.
+        """
+        return self.client.files.content(file_id).content
+
     def get_batch_result(self, output_file: str, batch_job: Batch) -> str | None:
         """
         Retrieves the result of a completed batch job and saves it to a specified file.
@@ -106,7 +327,7 @@ class OpenAIClient(LLMClient):
         if not result_file_id:
             return None
 
-        result = self.client.files.content(result_file_id).content
+        result = self.get_file_content(result_file_id)
 
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         with open(output_file, 'wb') as file:
@@ -149,12 +370,15 @@ class HuggingFaceClient(LLMClient):
     def __init__(self, config: LLMConfig):
         super().__init__(config)
         self.headers = {"Authorization": f"Bearer {Config.CREDENTIALS.hf_api_key}"}
+        self.session = get_session()
+        self.timeout = config.timeout or Config.HTTP_CONFIG.timeout
 
     def _call_client(self, prompt: str, temperature: float) -> str:
         payload = {'messages': self._get_messages(prompt),
                    'model': self.model,
                    'parameters': {'temperature': temperature}}
-        response = requests.post(self.config.api_url, headers=self.headers, json=payload, timeout=10)
+        response = self.session.post(self.config.api_url, headers=self.headers, json=payload, timeout=self.timeout)
+        response.raise_for_status()
         data = response.json()
         return data['choices'][0]['message']['content'].strip()
 
@@ -165,10 +389,13 @@ class HuggingFaceClient(LLMClient):
 
 
 class LocalLLMClient(LLMClient):
-    def __init__(self, config: LLMConfig):
+    max_concurrency = 1
+
+    @cached_property
+    def pipe(self):
+        """Load the pipeline on first use, so cached responses don't need the weights."""
         from transformers import pipeline
-        super().__init__(config)
-        self.pipe = pipeline(
+        return pipeline(
             "text-generation",
             model=self.model,
             device_map="auto",
@@ -177,29 +404,85 @@ class LocalLLMClient(LLMClient):
             trust_remote_code=True,
         )
 
+    @property
+    def batch_size(self) -> int:
+        return self.config.batch_size
+
     def _call_client(self, prompt: str, temperature: float) -> str:
         output = self.pipe(
             self._get_messages(prompt),
-            temperature=temperature,
+            **self._generation_kwargs(temperature)
         )
         return output[0]["generated_text"][1]['content'].strip()
 
+    def _call_client_batch(self, prompts: list[str], temperature: float) -> list[str]:
+        """
+        Generate the prompts in batches of batch_size.
+
+        The prompts are sorted by token length first, so each batch only needs little padding.
+        """
+        tokenizer = self.pipe.tokenizer
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        tokenizer.padding_side = 'left'
+
+        chats = [self._get_messages(prompt) for prompt in prompts]
+        lengths = [len(tokenizer.apply_chat_template(chat, add_generation_prompt=True)) for chat in chats]
+        order = sorted(range(len(chats)), key=lambda idx: lengths[idx])
+
+        responses = [None] * len(chats)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            outputs = self.pipe(
+                [chats[idx] for idx in batch],
+                batch_size=len(batch),
+                **self._generation_kwargs(temperature)
+            )
+            for idx, output in zip(batch, outputs):
+                responses[idx] = output[0]["generated_text"][1]['content'].strip()
+        return responses
+
+    def _stream_client(self, prompt: str, temperature: float) -> Iterator[str]:
+        from transformers import TextIteratorStreamer
+
+        tokenizer = self.pipe.tokenizer
+        input_ids = tokenizer.apply_chat_template(self._get_messages(prompt), add_generation_prompt=True,
+                                                  return_tensors='pt').to(self.pipe.model.device)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def generate():
+            try:
+                self.pipe.model.generate(input_ids=input_ids, streamer=streamer,
+                                         **self._generation_kwargs(temperature))
+            except Exception as e:
+                # Nothing else ends the streamer, the loop below would wait forever.
+                errors.append(e)
+                streamer.end()
+
+        generation = threading.Thread(target=generate)
+        generation.start()
+        for chunk in streamer:
+            if chunk:
+                yield chunk
+        generation.join()
+        if errors:
+            raise errors[0]
+
+    def _count_tokens(self, response: str, chunks: int) -> int:
+        # The streamer yields whole words, not tokens.
+        return len(self.pipe.tokenizer(response, add_special_tokens=False)['input_ids'])
+
+    def _generation_kwargs(self, temperature: float) -> dict:
+        return {'temperature': temperature, **self.DECODING_PARAMS}
+
     @staticmethod
     def _get_messages(prompt: str):
         return [{"role": "user", "content": prompt}, ]
 
 
 class QwenLocalClient(LocalLLMClient):
-    def __init__(self, config: LLMConfig):
-        super().__init__(config)
-
-    def _call_client(self, prompt: str, temperature: float) -> str:
-        output = self.pipe(
-            self._get_messages(prompt),
-            temperature=0.1,
-            max_new_tokens=512
-        )
-        return output[0]["generated_text"][1]['content'].strip()
+    DECODING_PARAMS = {'temperature': 0.1, 'max_new_tokens': 512}
 
 
 def get_llm_client(model: str) -> LLMClient:
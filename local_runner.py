@@ -0,0 +1,122 @@
+"""Multi-process response generation with one local model instance per worker."""
+import dataclasses
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+
+from tqdm import tqdm
+
+from cache import DiskCache
+from checkpoint import RunManifest
+from config import LLMConfig
+from latency_metrics import LATENCY_RECORDER, CallLatency
+from llm_client import LLamaCPPClient
+from reader import JSONLineAppender
+
+_CLIENT: LLamaCPPClient | None = None
+_STREAM = False
+
+
+@dataclasses.dataclass(frozen=True)
+class GenerationTask:
+    """One cell of the (dataset, lang, prompt_type, word) grid."""
+    output_file: str
+    prompt_template: str
+    idx: int
+    word: str
+
+
+def _init_worker(config: LLMConfig, cache_file: str | None, cache_only: bool, stream: bool):
+    global _CLIENT, _STREAM
+    _CLIENT = LLamaCPPClient(config)
+    if cache_file is not None:
+        _CLIENT.use_cache(DiskCache(cache_file), cache_only=cache_only)
+    _STREAM = stream
+
+
+def _generate_chunk(tasks: list[GenerationTask]) -> tuple[list[tuple[GenerationTask, str]],
+                                                         dict[str, list[CallLatency]]]:
+    """Generate the responses of a chunk and return them with the latencies recorded while streaming."""
+    responses = []
+    for task in tasks:
+        _CLIENT.cache_prompt_prefix(task.prompt_template.split('{word}')[0])
+        prompt = task.prompt_template.format(word=task.word)
+        model_response = ''.join(_CLIENT.stream_term(prompt)).strip() if _STREAM else _CLIENT.define_term(prompt)
+        responses.append((task, model_response))
+    return responses, LATENCY_RECORDER.pop_calls()
+
+
+class LocalGenerationRunner:
+    """
+    Generate responses for a grid of prompts with a pool of worker processes.
+
+    Every worker loads its own LLamaCPPClient with cpu_count // workers threads. The grid is split
+    into chunks that are handed out to the workers as they become free. The main process appends
+    the responses of every output file as soon as all preceding words of the file are done, so the
+    files stay in dataset order and an interrupted run can be resumed from them.
+    """
+
+    def __init__(self, config: LLMConfig, workers: int | None = None, chunk_size: int = 32,
+                 cache_file: str | None = None, cache_only: bool = False, stream: bool = False):
+        cpu_count = os.cpu_count() or 1
+        self.workers = workers or cpu_count
+        self.chunk_size = chunk_size
+        self.config = dataclasses.replace(config, n_threads=max(1, cpu_count // self.workers))
+        self.cache_file = cache_file
+        self.cache_only = cache_only
+        self.stream = stream
+
+    def run(self, jobs: list[tuple[list[dict], str, str, RunManifest | None]]):
+        """
+        Generate the responses of all jobs.
+
+        :param jobs: Tuples of (homonyms, prompt_template, output_file, manifest), like the arguments
+                     of generate_model_response. The manifests are updated as responses are written.
+        """
+        tasks = [
+            GenerationTask(output_file, prompt_template, idx, entry["word"])
+            for homonyms, prompt_template, output_file, _ in jobs
+            for idx, entry in enumerate(homonyms)
+        ]
+        manifests = {output_file: manifest for _, _, output_file, manifest in jobs}
+        # Chunks never mix templates more than necessary, so the prefix state of a worker stays warm.
+        chunks = [tasks[start:start + self.chunk_size] for start in range(0, len(tasks), self.chunk_size)]
+
+        # Responses that finished before an earlier word of the same file, by output file and index.
+        pending = {output_file: {} for output_file in manifests}
+        next_idx = dict.fromkeys(manifests, 0)
+
+        with (ExitStack() as stack,
+              ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                  initargs=(self.config, self.cache_file, self.cache_only, self.stream)) as executor,
+              tqdm(total=len(tasks), desc="Generating responses") as progress):
+            appenders = {output_file: stack.enter_context(JSONLineAppender(output_file)) for output_file in manifests}
+            futures = [executor.submit(_generate_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                responses, calls = future.result()
+                for model, latencies in calls.items():
+                    for latency in latencies:
+                        LATENCY_RECORDER.record(model, latency)
+
+                for task, model_response in responses:
+                    pending[task.output_file][task.idx] = {"word": task.word, "model_response": model_response}
+                for output_file in dict.fromkeys(task.output_file for task, _ in responses):
+                    self._write_finished(output_file, pending[output_file], next_idx, appenders[output_file],
+                                         manifests[output_file])
+                progress.update(len(responses))
+
+    @staticmethod
+    def _write_finished(output_file: str, pending: dict[int, dict], next_idx: dict[str, int],
+                        appender: JSONLineAppender, manifest: RunManifest | None):
+        """Append the responses of output_file that directly follow the ones already written."""
+        finished = []
+        while next_idx[output_file] in pending:
+            finished.append(pending.pop(next_idx[output_file]))
+            next_idx[output_file] += 1
+        if not finished:
+            return
+        appender.write_all(finished)
+        appender.flush()
+        if manifest is not None:
+            manifest.completed += len(finished)
+            manifest.save(output_file)
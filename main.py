@@ -2,6 +2,7 @@ from argparse import ArgumentParser
 
 from datasets import load_dataset
 
+from cache import DiskCache
 from config import Config, Credentials
 from evaluation import HomonymEvaluator
 from analysis import ResultAnalyzer
@@ -15,6 +16,14 @@ def main(response_llm: str = Config.DEFAULT_RESPONSE_LLM):
     parser = ArgumentParser()
     parser.add_argument("--prompt_type", default='simple', type=str,
                         help="The type of prompt to use. Default 'simple'. Choose between 'child', 'simple', 'normal'")
+    parser.add_argument("--response-cache", action='store_true',
+                        help="Cache the model responses in Config.RESPONSE_CACHE_FILE.")
+    parser.add_argument("--cache-only", action='store_true',
+                        help="Only serve cached model responses and fail on the first miss. Implies --response-cache.")
+    parser.add_argument("--results-file", default=None, type=str,
+                        help="Jsonl file the results are written to. Default: Config.RESULTS_FILE")
+    parser.add_argument("--resume", action='store_true',
+                        help="Skip the words that already have a result in --results-file.")
     args = parser.parse_args()
 
     if not validate_llm(response_llm):
@@ -24,11 +33,14 @@ def main(response_llm: str = Config.DEFAULT_RESPONSE_LLM):
     homonyms = load_dataset(Config.DATASET, token=Credentials.hf_api_key)['train'].to_list()
     print(f"Loaded {len(homonyms)} homonyms from HF")
 
-    results_file = Config.RESULTS_FILE.replace('prompt_type', args.prompt_type)
+    results_file = args.results_file or Config.RESULTS_FILE.replace('prompt_type', args.prompt_type)
     parsed_results_file = Config.PARSED_RESULTS_FILE.replace('prompt_type', args.prompt_type)
 
-    evaluator = HomonymEvaluator(response_llm=response_llm, prompt_type=args.prompt_type)
-    evaluator.evaluate_homonyms(homonyms, results_file)
+    response_cache = DiskCache(Config.RESPONSE_CACHE_FILE) if args.response_cache or args.cache_only else None
+    evaluator = HomonymEvaluator(response_llm=response_llm, prompt_type=args.prompt_type,
+                                 judge_cache=DiskCache(Config.JUDGE_CACHE_FILE),
+                                 response_cache=response_cache, cache_only=args.cache_only)
+    evaluator.evaluate_homonyms(homonyms, results_file, resume=args.resume, dataset=Config.DATASET)
     print(f"Results saved to {results_file}")
 
     EvaluationParser().parse_evaluation(results_file, parsed_results_file)
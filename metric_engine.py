@@ -0,0 +1,176 @@
+"""
+Module for computing the result metrics of many cells at once.
+
+A cell is the list of parsed results of one (type, model[, lang]) combination. All cells are loaded
+into one DataFrame and every metric is computed for all cells with grouped, vectorized operations.
+The metrics of a cell are returned in the dict format of Analysis.analyze_results.
+"""
+import itertools
+from collections.abc import Hashable
+
+import numpy as np
+import pandas as pd
+import textstat
+
+READING_SCORES = {
+    'fkgl': lambda text: textstat.textstat.flesch_kincaid_grade(text),
+    'fre': lambda text: textstat.textstat.flesch_reading_ease(text),
+}
+# Languages supported by textstat, the others are scored as English.
+TEXTSTAT_LANGUAGES = ('en', 'fr', 'ru')
+
+
+def _python(value):
+    """Convert numpy scalars and missing values in group keys back to plain python values."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _counts(frame: pd.DataFrame, columns: list[str]) -> dict[int, dict]:
+    """Nested {cell: {value: ... count}} of the columns in the order of first occurrence, like a Counter."""
+    sizes = frame.groupby(['cell', *columns], sort=False, dropna=False).size()
+    counts = {}
+    for key, size in sizes.items():
+        node = counts.setdefault(key[0], {})
+        for value in key[1:-1]:
+            node = node.setdefault(_python(value), {})
+        node[_python(key[-1])] = int(size)
+    return counts
+
+
+def results_frame(cells: list[list[dict]], model_responses: bool = True) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Load the results of all cells into one DataFrame with the columns the metrics need.
+
+    :return: The frame, sorted by its cell column, and the rows whose wordnet_rankings match a WordNet
+             sense more than once.
+    """
+    results = [result for cell_results in cells for result in cell_results]
+    columns = {
+        'cell': np.repeat(np.arange(len(cells)), [len(cell_results) for cell_results in cells]),
+        'category': [result['category'] for result in results],
+        'complete_marker': [result['complete_marker'] for result in results],
+        'n_definitions': np.fromiter((len(result['definitions']) for result in results), dtype=np.int64,
+                                     count=len(results)),
+        'coarse_synsets_covered': np.fromiter((result.get('coarse_synsets_covered', np.nan) for result in results),
+                                              dtype=np.float64, count=len(results)),
+    }
+    if model_responses:
+        columns['model_response'] = [result['model_response'] for result in results]
+
+    ranking_lists = [result.get('wordnet_rankings') or [] for result in results]
+    ranking_rows = np.repeat(np.arange(len(ranking_lists)), [len(rankings) for rankings in ranking_lists])
+    ranking_values = np.fromiter(itertools.chain.from_iterable(ranking_lists), dtype=np.int64,
+                                 count=len(ranking_rows))
+    return pd.DataFrame(columns), repeated_sense_rows(ranking_rows, ranking_values)
+
+
+def repeated_sense_rows(ranking_rows: np.ndarray, ranking_values: np.ndarray) -> np.ndarray:
+    """Rows with a WordNet ranking other than -1 more than once, given the flattened rankings and their rows."""
+    matched = ranking_values != -1
+    base = int(ranking_values.max(initial=0)) + 1
+    pairs, pair_counts = np.unique(ranking_rows[matched] * base + ranking_values[matched], return_counts=True)
+    return np.unique(pairs[pair_counts > 1] // base)
+
+
+def reading_scores(frame: pd.DataFrame, cell_langs: list[str], reading_score: str) -> pd.Series:
+    """Mean reading score of the model responses of each cell, scored in the language of the cell."""
+    score = READING_SCORES[reading_score]
+    languages = pd.Series([lang if lang in TEXTSTAT_LANGUAGES else 'en' for lang in cell_langs])
+    scores = pd.Series(np.nan, index=frame.index)
+    for lang, cells in languages.groupby(languages).groups.items():
+        textstat.textstat.set_lang(lang)
+        rows = frame['cell'].isin(cells)
+        scores[rows] = frame.loc[rows, 'model_response'].map(score)
+    return scores.groupby(frame['cell']).mean()
+
+
+def analyze_cells(cells: dict[Hashable, list[dict]], fk_grades: bool = True, langs: dict[Hashable, str] | None = None,
+                  reading_score: str = 'fkgl') -> dict[Hashable, dict]:
+    """
+    Compute the metrics of all cells in one pass.
+
+    :param cells: Parsed results of each cell, every cell needs at least one result.
+    :param fk_grades: Whether to compute the reading score of the model responses.
+    :param langs: Language of each cell for the reading score, English if None.
+    :param reading_score: fkgl (Flesch-Kincaid grade) or fre (Flesch reading ease).
+    :return: The metrics of each cell in the format of Analysis.analyze_results.
+    """
+    keys = list(cells)
+    frame, repeated = results_frame([cells[key] for key in keys], model_responses=fk_grades)
+    cell = frame['cell'].to_numpy()
+
+    def per_cell(mask=None, weights=None) -> np.ndarray:
+        return np.bincount(cell if mask is None else cell[mask], minlength=len(keys),
+                           weights=None if weights is None else weights if mask is None else weights[mask])
+
+    marker_true = frame['complete_marker'].eq(True).to_numpy()
+    marker_false = frame['complete_marker'].eq(False).to_numpy()
+    coverage_values = frame['coarse_synsets_covered'].to_numpy()
+    covered = coverage_values == 1
+    multiple = frame['category'].eq('Multiple').to_numpy()
+    n_definitions = frame['n_definitions'].to_numpy()
+    frame['covered'] = covered
+
+    totals = per_cell()
+    # Like the rest of the analysis, whether a cell has coverage is decided by its first result.
+    has_coverage = ~np.isnan(coverage_values[np.searchsorted(cell, np.arange(len(keys)))])
+    n_marker, n_multiple = per_cell(marker_true), per_cell(multiple)
+    n_both, n_full_only = per_cell(marker_true & covered), per_cell(marker_false & covered)
+    n_multi_if_marker, n_sense_aware = per_cell(multiple & marker_true), per_cell(multiple | marker_true)
+    avg_definitions = per_cell(weights=n_definitions.astype(np.float64)) / totals
+    in_multi = n_definitions > 1
+    n_in_multi = per_cell(in_multi)
+    avg_definitions_in_multi = per_cell(in_multi, n_definitions.astype(np.float64)) / np.maximum(n_in_multi, 1)
+    # np.mean per contiguous cell keeps the float summation order of the per-cell analysis.
+    bounds = np.concatenate([[0], np.cumsum(totals)])
+    coverage = [np.mean(coverage_values[start:end]) * 100 for start, end in zip(bounds[:-1], bounds[1:])]
+
+    n_multi_same = np.bincount(cell[repeated], minlength=len(keys))
+
+    category_counts = _counts(frame, ['category'])
+    marker_counts = _counts(frame, ['complete_marker'])
+    has_coverage_rows = has_coverage[cell]
+    joint_with_coverage = _counts(frame[has_coverage_rows], ['category', 'complete_marker', 'covered'])
+    joint_without_coverage = _counts(frame[~has_coverage_rows], ['category', 'complete_marker'])
+
+    fk_grade = None
+    if fk_grades:
+        langs = langs or {}
+        fk_grade = reading_scores(frame, [langs.get(key, 'en') for key in keys], reading_score)
+
+    stats = {}
+    for index, key in enumerate(keys):
+        total = int(totals[index])
+        marker, multi = int(n_marker[index]), int(n_multiple[index])
+        multi_same = int(n_multi_same[index])
+
+        completeness = None
+        if has_coverage[index]:
+            both, full_only = int(n_both[index]), int(n_full_only[index])
+            completeness = {
+                'complete': (marker + full_only) / total * 100,
+                'both': both / total * 100,
+                'context': marker / total * 100,
+                'full': (full_only + both) / total * 100,
+            }
+
+        stats[key] = {
+            'total': total,
+            'fk_grade': fk_grade[index] if fk_grade is not None else None,
+            'definition_counts': {
+                'avg_definitions': avg_definitions[index],
+                'avg_definitions_in_multi': avg_definitions_in_multi[index] if n_in_multi[index] else 0,
+            },
+            'category_distribution': category_counts[index],
+            'complete_markers_distribution': marker_counts[index],
+            'joint_counter': (joint_with_coverage if has_coverage[index] else joint_without_coverage)[index],
+            'completeness': completeness,
+            'coarse_synset_coverage': coverage[index] if has_coverage[index] else None,
+            'multi_if_marker': int(n_multi_if_marker[index]) / marker if marker else None,
+            'sense_awareness': int(n_sense_aware[index]) / total * 100,
+            'more_than_one': multi / total * 100,
+            'multi_same_def': multi_same / multi * 100 if has_coverage[index] and multi_same and multi else None,
+        }
+    return stats
@@ -1,13 +1,12 @@
-import time
 from statistics import mean
-import requests
-from requests import HTTPError
 
 from config import Config
+from http_session import get_session
 
 class NgramFetcher:
     def __init__(self):
         self.config = Config.NGRAM_CONFIG
+        self.session = get_session(self.config.http_config)
 
     def fetch_ngram_data(self, words: list[str], inflections: bool = False, corpus='en') -> dict[str, dict]:
         """Fetch Ngram frequency data for multiple words in batches."""
@@ -37,14 +36,10 @@ class NgramFetcher:
                 headers = {
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/98.0.4758.87"
                 }
-                response = requests.get(self.config.base_url, params=params, headers=headers, timeout=30)
-                try:
-                    response.raise_for_status()
-                except HTTPError as e:
-                    print(f"{e} - sleeping 10 sec.")
-                    time.sleep(10)
-                    response = requests.get(self.config.base_url, params=params, headers=headers, timeout=30)
-                    response.raise_for_status()
+                # Throttling (429) and server errors are retried with backoff by the session.
+                response = self.session.get(self.config.base_url, params=params, headers=headers,
+                                            timeout=self.config.http_config.timeout)
+                response.raise_for_status()
                 data = response.json()
 
                 if data and isinstance(data, list):
@@ -3,6 +3,7 @@ from datasets import load_dataset
 from LLMJudge import JUDGE_PROMPT_TEMPLATE
 from config import LLMConfig, Config, Credentials, PROJECT_DIR
 from evaluation import PROMPT_TEMPLATES
+from batch_orchestrator import BatchJobSpec, BatchOrchestrator
 from llm_client import OpenAIClient
 from reader import JSONLineReader
 
@@ -10,6 +11,7 @@ TYPE = 'simple_w_context'
 DATASET = 'homonymy-high-freq'
 RESPONSE_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-responses-gpt-4o-mini-{TYPE}.jsonl'
 OUTPUT_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-input-judge-{TYPE}.jsonl'
+RAW_JUDGES_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-raw-output-judge-{TYPE}.jsonl'
 
 client = OpenAIClient(LLMConfig(
             model="gpt-4.1-mini-2025-04-14", #gpt-4o-mini-2024-07-18",
@@ -70,5 +72,6 @@ for idx, entry in enumerate(dataset_response):
     }
     tasks.append(task)
 
-JSONLineReader().write(OUTPUT_FILE, tasks)
-client.create_batch_job(OUTPUT_FILE, endpoint='/v1/responses')
+JSONLineReader().write(OUTPUT_FILE, tasks, mode='w')
+BatchOrchestrator(BatchJobSpec(name=f'judge-{DATASET}-{TYPE}', input_file=OUTPUT_FILE, output_file=RAW_JUDGES_FILE,
+                               endpoint='/v1/responses'), client).run()
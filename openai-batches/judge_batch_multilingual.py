@@ -3,12 +3,14 @@ from datasets import load_dataset
 from LLMJudge import JUDGE_PROMPT_TEMPLATE
 from config import LLMConfig, Config, Credentials, PROJECT_DIR
 from evaluation import PROMPT_TEMPLATES
+from batch_orchestrator import BatchJobSpec, BatchOrchestrator
 from llm_client import OpenAIClient
 from reader import JSONLineReader
 
 DATASET = 'mcl-wic'
 LANGUAGES = ['en'] #, 'ar'] #, 'ru', 'zh']
 OUTPUT_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-input-judge-en.jsonl'
+RAW_JUDGES_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-raw-output-judge-en.jsonl'
 
 client = OpenAIClient(LLMConfig(
             model="gpt-4.1-mini-2025-04-14",
@@ -75,5 +77,6 @@ for language in LANGUAGES:
             }
             tasks.append(task)
 
-JSONLineReader().write(OUTPUT_FILE, tasks)
-client.create_batch_job(OUTPUT_FILE, endpoint='/v1/responses')
+JSONLineReader().write(OUTPUT_FILE, tasks, mode='w')
+BatchOrchestrator(BatchJobSpec(name=f'judge-{DATASET}', input_file=OUTPUT_FILE, output_file=RAW_JUDGES_FILE,
+                               endpoint='/v1/responses'), client).run()
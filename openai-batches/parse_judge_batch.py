@@ -2,6 +2,7 @@ import json
 
 from datasets import load_dataset
 
+from batch_join import BatchJoiner
 from config import Config, Credentials, PROJECT_DIR
 from evaluation_parser import EvaluationParser
 from reader import JSONLineReader
@@ -18,17 +19,14 @@ dataset = load_dataset(Config.DATASETS[DATASET], token=Credentials.hf_api_key)['
 judge_outputs = JSONLineReader().read(RAW_JUDGES_FILE)
 responses = JSONLineReader().read(RESPONSES_FILE)
 
+joiner = BatchJoiner(judge=judge_outputs, responses=responses)
 intermediate_results = []
-for result in judge_outputs:
-    c_id = result['custom_id'].split('task-')[1]
-    model_response = None
-    for response in responses:
-        if response['custom_id'].split('task-')[1] == c_id:
-            model_response = response['response']['body']['choices'][0]['message']['content']
-            break
-    assert model_response is not None, f'Could not find model response for id {c_id}'
+for key, lines in joiner.join(joiner.keys('judge')):
+    c_id = key.idx
+    result = lines['judge']
+    model_response = lines['responses']['response']['body']['choices'][0]['message']['content']
 
-    entry = dataset[int(c_id)]
+    entry = dataset[c_id]
 
     try:
         message = result['response']['body']['output'][0]['content'][0]['text']
@@ -46,6 +44,7 @@ for result in judge_outputs:
         }
     )
 
+joiner.report()
 JSONLineReader().write(OUTPUT_FILE, intermediate_results)
 
 EvaluationParser().parse_evaluation(OUTPUT_FILE, PARSED_OUTPUT_FILE)
@@ -3,6 +3,7 @@ import json
 from datasets import load_dataset
 from tqdm import tqdm
 
+from batch_join import BatchJoiner
 from config import Config, Credentials, PROJECT_DIR
 from evaluation_parser import EvaluationParser
 from reader import JSONLineReader
@@ -11,9 +12,11 @@ DATASET = 'mcl-wic'
 LANGUAGES = ['en']
 
 datadict = load_dataset(Config.DATASETS[DATASET], token=Credentials.hf_api_key)
+parse_files = []
 for lang in tqdm(LANGUAGES):
     RAW_JUDGES_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-raw-output-judge-{lang}.jsonl'
     judge_outputs = JSONLineReader().read(RAW_JUDGES_FILE)
+    joiner = BatchJoiner(judge=judge_outputs)
     dataset = datadict[lang].to_list()
 
     for TYPE in ['child', 'simple', 'normal']:
@@ -21,21 +24,15 @@ for lang in tqdm(LANGUAGES):
         OUTPUT_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-output-judge-{TYPE}-{lang}.jsonl'
         PARSED_OUTPUT_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-output-judge-{TYPE}-{lang}-parsed.jsonl'
 
-        responses = JSONLineReader().read(RESPONSES_FILE)
+        joiner.add_source('responses', JSONLineReader().read(RESPONSES_FILE))
 
         intermediate_results = []
-        for response in responses:
-            c_id = response['custom_id'].split(f'task-{lang}-{TYPE}-')[1]
-            model_response = response['response']['body']['choices'][0]['message']['content']
+        for key, lines in joiner.join(joiner.keys('responses')):
+            c_id = key.idx
+            model_response = lines['responses']['response']['body']['choices'][0]['message']['content']
+            found_result = lines['judge']
 
-            found_result = None
-            for result in judge_outputs:
-                if TYPE in result['custom_id'] and result['custom_id'].split(f'task-{lang}-{TYPE}-')[1] == c_id:
-                    found_result = result
-                    break
-            assert found_result is not None, f'Could not find judge result for id {c_id} - {lang} - {TYPE}'
-
-            entry = dataset[int(c_id)]
+            entry = dataset[c_id]
 
             try:
                 message = found_result['response']['body']['output'][0]['content'][0]['text']
@@ -53,6 +50,8 @@ for lang in tqdm(LANGUAGES):
                 }
             )
 
+        joiner.report()
         JSONLineReader().write(OUTPUT_FILE, intermediate_results)
+        parse_files.append((OUTPUT_FILE, PARSED_OUTPUT_FILE))
 
-        EvaluationParser().parse_evaluation(OUTPUT_FILE, PARSED_OUTPUT_FILE, add_wordnet=False)
+EvaluationParser().parse_evaluations(parse_files, add_wordnet=False)
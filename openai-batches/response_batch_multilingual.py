@@ -2,6 +2,7 @@ from datasets import load_dataset
 
 from config import LLMConfig, Config, Credentials, PROJECT_DIR
 from evaluation import PROMPT_TEMPLATES
+from batch_orchestrator import BatchJobSpec, BatchOrchestrator
 from llm_client import OpenAIClient
 from reader import JSONLineReader
 
@@ -9,6 +10,7 @@ DATASET = 'mcl-wic'
 MODEL = 'gpt-4o-mini-2024-07-18'
 LANGUAGES = ['en'] #, 'ar'] #, 'ru', 'zh']
 OUTPUT_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-input-gpt-4o-mini.jsonl'
+RAW_RESPONSES_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-raw-responses-gpt-4o-mini.jsonl'
 
 client = OpenAIClient(LLMConfig(
             model=MODEL,
@@ -38,5 +40,15 @@ for lang in LANGUAGES:
             }
             tasks.append(task)
 
-JSONLineReader().write(OUTPUT_FILE, tasks)
-client.create_batch_job(OUTPUT_FILE)
+JSONLineReader().write(OUTPUT_FILE, tasks, mode='w')
+BatchOrchestrator(BatchJobSpec(name=f'responses-{DATASET}', input_file=OUTPUT_FILE,
+                               output_file=RAW_RESPONSES_FILE), client).run()
+
+# Split the results into the response file of each language and prompt type.
+results = {result['custom_id']: result for result in JSONLineReader().read(RAW_RESPONSES_FILE)}
+for lang in LANGUAGES:
+    for TYPE in ['simple', 'normal', 'child']:
+        prefix = f"task-{lang}-{TYPE}-"
+        RESPONSES_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{DATASET}-responses-gpt-4o-mini-{TYPE}-{lang}.jsonl'
+        JSONLineReader().write(RESPONSES_FILE, [result for custom_id, result in results.items()
+                                                if custom_id.startswith(prefix)], mode='w')
@@ -0,0 +1,214 @@
+"""Module for client side rate limiting of provider APIs."""
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse a rate limit reset header like "20ms", "1.5s" or "6m0s" into seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after(headers) -> float | None:
+    """Return the delay requested by the retry-after(-ms) headers in seconds."""
+    if headers is None:
+        return None
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    return parse_duration(headers.get('retry-after'))
+
+
+class TokenBucket:
+    """
+    Token bucket allowing rate requests per second with bursts of up to capacity requests.
+
+    Without a rate only blocks set through block() are enforced.
+    """
+
+    def __init__(self, rate: float | None = None, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else (rate or 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a request may be sent and take a token for it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.blocked_until > now:
+                    wait = self.blocked_until - now
+                elif self.rate is None:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def block(self, seconds: float):
+        """Do not hand out tokens for the next seconds."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class AdaptiveConcurrency:
+    """
+    Limit the number of requests in flight with additive increase, multiplicative decrease.
+
+    Every successful request raises the limit by 1/limit, so by one per limit successes. A throttled
+    request multiplies it by decrease_factor, at most once per cooldown seconds so that a burst of
+    rejections of the same window only counts once.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64, decrease_factor: float = 0.5,
+                 cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.active = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= math.floor(self.limit):
+                self._condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+
+@dataclass
+class RateLimitStats:
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failures: int = 0
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.retries} retries, {self.throttled} throttled, "
+                f"{self.failures} failed")
+
+
+class RateLimiter:
+    """
+    Send requests within the rate limits of a provider.
+
+    Requests are paced by a token bucket and their concurrency is adapted to the 429s of the provider.
+    The x-ratelimit-remaining-* and x-ratelimit-reset-* headers of the responses pause the bucket
+    until the quota resets once it is used up. Retryable errors are retried with exponential backoff
+    and full jitter, respecting retry-after headers; all other errors and the last retryable error
+    are raised.
+    """
+    QUOTAS = ('requests', 'tokens')
+
+    def __init__(self, requests_per_minute: int | None = None, max_retries: int = 6, base_delay: float = 1.0,
+                 max_delay: float = 60.0, concurrency: AdaptiveConcurrency | None = None):
+        rate = requests_per_minute / 60 if requests_per_minute else None
+        self.bucket = TokenBucket(rate, capacity=max(1.0, rate) if rate else None)
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = RateLimitStats()
+        self._lock = threading.Lock()
+
+    def call(self, request, retryable: tuple[type[Exception], ...]):
+        """
+        Send a request, retrying it on retryable errors.
+
+        :param request: Function sending the request, returning a response with headers.
+        :param retryable: Exception types that are worth retrying. Exceptions with status_code 429
+                          throttle the concurrency.
+        :return: The response of request.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                with self.concurrency:
+                    self._count('requests')
+                    response = request()
+            except retryable as e:
+                headers = getattr(getattr(e, 'response', None), 'headers', None)
+                self.update(headers)
+                if getattr(e, 'status_code', None) == 429:
+                    self._count('throttled')
+                    self.concurrency.on_throttle()
+                if attempt == self.max_retries:
+                    self._count('failures')
+                    raise
+
+                delay = max(retry_after(headers) or 0, self.backoff(attempt))
+                self._count('retries')
+                time.sleep(delay)
+            else:
+                self.update(response.headers)
+                self.concurrency.on_success()
+                return response
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter exponential backoff delay for the given attempt."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def update(self, headers):
+        """Pause the bucket until the reset time of an exhausted quota."""
+        if headers is None:
+            return
+        for quota in self.QUOTAS:
+            remaining = headers.get(f'x-ratelimit-remaining-{quota}')
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{quota}'))
+            try:
+                exhausted = remaining is not None and float(remaining) <= 0
+            except ValueError:
+                continue
+            if exhausted and reset:
+                self.bucket.block(reset)
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self.stats, field, getattr(self.stats, field) + 1)
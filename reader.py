@@ -1,6 +1,50 @@
 """Module for reading files."""
 import json
 import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+@dataclass(frozen=True)
+class JSONBackend:
+    name: str
+    loads: Callable[[str | bytes], object]
+    dumps: Callable[[object], str]
+
+
+JSON_BACKENDS = {'json': JSONBackend('json', json.loads, lambda obj: json.dumps(obj, ensure_ascii=False))}
+if ujson is not None:
+    JSON_BACKENDS['ujson'] = JSONBackend('ujson', ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=False))
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = JSONBackend(
+        'orjson', orjson.loads, lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8'))
+
+# Fastest available backend, the optional orjson and ujson packages are preferred over the stdlib.
+_backend = next(JSON_BACKENDS[name] for name in ('orjson', 'ujson', 'json') if name in JSON_BACKENDS)
+
+
+def get_json_backend() -> JSONBackend:
+    return _backend
+
+
+def set_json_backend(name: str):
+    """Select the json backend used by the readers, one of JSON_BACKENDS."""
+    global _backend
+    if name not in JSON_BACKENDS:
+        raise ValueError(f"JSON backend {name} is not available, choose one of {list(JSON_BACKENDS)}")
+    _backend = JSON_BACKENDS[name]
 
 
 class Reader:
@@ -28,24 +72,219 @@ class Reader:
         """Process an opened file."""
 
 
+@dataclass
+class JSONLineIndex:
+    """
+    Byte offsets of the records of a .jsonl file.
+
+    Records are numbered like JSONLineReader.iter yields them, i.e. without empty and invalid lines.
+    keys maps each indexed field to its values and their record number, the last record wins for
+    duplicate values. mtime_ns and size identify the version of the file the index was built for.
+    """
+    mtime_ns: int
+    size: int
+    offsets: list[int]
+    keys: dict[str, dict[str, int]]
+
+    def is_valid(self, file) -> bool:
+        stat = os.stat(file)
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+
 class JSONLineReader(Reader):
-    """Reader for .jsonl files."""
+    """
+    Reader for .jsonl files.
+
+    Lines that are not valid json are handled according to on_error: 'skip' ignores them, 'warn'
+    prints a warning and ignores them, 'raise' raises a ValueError. Empty lines are always ignored.
+
+    read_at, read_by_key and sample only parse the requested records. They seek to them with a
+    JSONLineIndex, which is stored next to the file as <file>.idx and rebuilt when the file changed.
+    """
+    ERROR_POLICIES = ('skip', 'warn', 'raise')
+    INDEX_KEYS = ('word', 'custom_id')
+
+    def __init__(self, encoding="utf-8", on_error='skip'):
+        super().__init__(encoding)
+        if on_error not in self.ERROR_POLICIES:
+            raise ValueError(f"Unknown error policy: {on_error}, expected one of {self.ERROR_POLICIES}")
+        self.on_error = on_error
+        self.indexes: dict[str, JSONLineIndex] = {}
+
+    def iter(self, file, fields=None):
+        """
+        Lazily read each line as json object.
+
+        :param file: Path of the .jsonl file.
+        :param fields: Keys to keep of each object, all keys if None.
+        :return: Iterator over the objects, only one line is held in memory at a time.
+        """
+        # Lines are parsed as bytes, which saves decoding them for backends that accept bytes.
+        with open(file, "rb") as f:
+            yield from self._iter_lines(f, fields)
 
     def process(self, file):
         """Read each line as json object."""
-        data = []
-        for line in file.readlines():
+        return list(self._iter_lines(file))
+
+    def index(self, file) -> JSONLineIndex:
+        """Return the index of a .jsonl file, loading or rebuilding its sidecar file if needed."""
+        index = self.indexes.get(file)
+        if index is not None and index.is_valid(file):
+            return index
+
+        index_file = f"{file}.idx"
+        index = None
+        if os.path.exists(index_file):
+            index = JSONLineIndex(**JSONReader().read(index_file))
+        if index is None or not index.is_valid(file):
+            index = self._build_index(file)
+            JSONReader().write(index_file, index.__dict__, mode='w')
+        self.indexes[file] = index
+        return index
+
+    def count(self, file) -> int:
+        """Number of records of the file."""
+        return len(self.index(file).offsets)
+
+    def read_at(self, file, positions: list[int], fields=None) -> list:
+        """
+        Read the records at the given positions.
+
+        :param file: Path of the .jsonl file.
+        :param positions: Record numbers, counted from 0 like the records of iter.
+        :param fields: Keys to keep of each object, all keys if None.
+        :return: The records in the order of positions.
+        """
+        offsets = self.index(file).offsets
+        records = []
+        with open(file, "rb") as f:
+            for position in positions:
+                f.seek(offsets[position])
+                record = self._loads(f.readline().strip())
+                if fields is not None:
+                    record = {key: record[key] for key in fields if key in record}
+                records.append(record)
+        return records
+
+    def read_by_key(self, file, key: str, value, fields=None):
+        """Read the record whose key field has the given value, e.g. key='word', or None if there is none."""
+        index = self.index(file)
+        if key not in index.keys:
+            raise ValueError(f"{key} is not indexed, indexed keys are {list(index.keys)}")
+        position = index.keys[key].get(str(value))
+        return None if position is None else self.read_at(file, [position], fields)[0]
+
+    def sample(self, file, sample_size: int, seed=None, fields=None) -> list:
+        """
+        Read a random sample of records without parsing the other records.
+
+        The sample equals random.sample(list(self.iter(file)), sample_size) after random.seed(seed).
+        """
+        positions = random.Random(seed).sample(range(self.count(file)), sample_size)
+        return self.read_at(file, positions, fields)
+
+    def _build_index(self, file) -> JSONLineIndex:
+        stat = os.stat(file)
+        offsets = []
+        keys = {key: {} for key in self.INDEX_KEYS}
+        with open(file, "rb") as f:
+            offset = 0
+            for line in f:
+                stripped = line.strip()
+                if stripped:
+                    try:
+                        record = self._loads(stripped)
+                    except ValueError:
+                        record = None
+                    else:
+                        if isinstance(record, dict):
+                            for key, values in keys.items():
+                                if key in record:
+                                    values[str(record[key])] = len(offsets)
+                        offsets.append(offset)
+                offset += len(line)
+        return JSONLineIndex(stat.st_mtime_ns, stat.st_size, offsets,
+                             {key: values for key, values in keys.items() if values})
+
+    def _loads(self, line):
+        if isinstance(line, bytes) and (_backend.name != 'orjson' or self.enc != 'utf-8'):
+            line = line.decode(self.enc)
+        return _backend.loads(line)
+
+    def _iter_lines(self, file, fields=None):
+        for line_number, line in enumerate(file, start=1):
+            line = line.strip()
+            if not line:
+                continue
             try:
-                data.append(json.loads(line.strip()))
-            except json.decoder.JSONDecodeError:
-                pass
+                record = self._loads(line)
+            except ValueError as e:
+                if self.on_error == 'raise':
+                    raise ValueError(f"Invalid json in {file.name} line {line_number}: {e}") from e
+                if self.on_error == 'warn':
+                    print(f"Skipping invalid json in {file.name} line {line_number}: {e}")
+                continue
 
-        return data
+            if fields is not None:
+                record = {key: record[key] for key in fields if key in record}
+            yield record
 
     def _write(self, file, lines):
+        dumps = _backend.dumps
+        file.writelines(f"{dumps(line)}\n" for line in lines)
+
+
+class JSONLineAppender:
+    """
+    Append json objects to a .jsonl file through a handle that stays open.
+
+    Objects are buffered and written every flush_every objects. With fsync_interval the file is
+    additionally synced to disk at most every fsync_interval seconds, otherwise only on close.
+    Use it as a context manager or call close() to write the remaining buffer.
+    """
+
+    def __init__(self, file, flush_every: int = 1, fsync_interval: float | None = None, encoding="utf-8"):
+        if os.path.dirname(file):
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+        self.file = open(file, 'a', encoding=encoding)
+        self.flush_every = flush_every
+        self.fsync_interval = fsync_interval
+        self.buffer = []
+        self.last_fsync = time.monotonic()
+
+    def write(self, line):
+        """Append one object."""
+        self.buffer.append(_backend.dumps(line))
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def write_all(self, lines):
+        """Append several objects."""
         for line in lines:
-            json.dump(line, file, ensure_ascii=False)
-            file.write('\n')
+            self.write(line)
+
+    def flush(self, fsync: bool = False):
+        """Write the buffer to the file and sync it to disk if fsync is set or due."""
+        if self.buffer:
+            self.file.write(''.join(f"{line}\n" for line in self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+        if fsync or (self.fsync_interval is not None
+                     and time.monotonic() - self.last_fsync >= self.fsync_interval):
+            os.fsync(self.file.fileno())
+            self.last_fsync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush(fsync=True)
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class JSONReader(Reader):
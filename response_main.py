@@ -3,10 +3,14 @@ import argparse
 from datasets import load_dataset
 from tqdm import tqdm
 
+from cache import DiskCache
+from checkpoint import RunManifest, dataset_revision, resume_offset
 from config import Config, Credentials, LLMConfig
 from evaluation import PROMPT_TEMPLATES
+from latency_metrics import LATENCY_RECORDER
 from llm_client import LLamaCPPClient
-from reader import JSONLineReader
+from local_runner import LocalGenerationRunner
+from reader import JSONLineAppender
 
 TYPES = ['simple', 'child', 'normal']
 LANGUAGES = ['en', 'fr', 'ru', 'ar', 'zh']
@@ -16,16 +20,31 @@ MODEL = 'mistral-7b-instruct'
 
 CLIENT = LLamaCPPClient(LLMConfig(model="mistral-7b-instruct-v0.2.Q4_K_M.gguf"))
 
-def generate_model_response(homonyms: list[dict], prompt_template: str, output_file: str):
-    for h in homonyms:
-        word = h["word"]
-        prompt = prompt_template.format(word=word)
-        model_response = CLIENT.define_term(prompt)
-        result = {
-            "word": word,
-            "model_response": model_response,
-        }
-        JSONLineReader().write(output_file, [result])
+def generate_model_response(homonyms: list[dict], prompt_template: str, output_file: str,
+                            manifest: RunManifest | None = None, stream: bool = False):
+    CLIENT.cache_prompt_prefix(prompt_template.split('{word}')[0])
+    with JSONLineAppender(output_file) as appender:
+        for h in homonyms:
+            word = h["word"]
+            prompt = prompt_template.format(word=word)
+            model_response = ''.join(CLIENT.stream_term(prompt)).strip() if stream else CLIENT.define_term(prompt)
+            result = {
+                "word": word,
+                "model_response": model_response,
+            }
+            appender.write(result)
+            if manifest is not None:
+                manifest.completed += 1
+                manifest.save(output_file)
+
+
+def create_job(homonyms: list[dict], prompt_key: str, output_file: str, dataset_repo: str, revision: str | None,
+               resume: bool):
+    """Return the arguments of generate_model_response, without the homonyms already answered if resuming."""
+    start = resume_offset(homonyms, output_file) if resume else 0
+    manifest = RunManifest(model=MODEL, prompt_key=prompt_key, dataset=dataset_repo, dataset_revision=revision,
+                           completed=start, total=len(homonyms))
+    return homonyms[start:], PROMPT_TEMPLATES.get(prompt_key), output_file, manifest
 
 
 def main():
@@ -38,35 +57,59 @@ def main():
     parser.add_argument('--without-context', action='store_true', default=True, help='Analyze without context')
     parser.add_argument('--without-hown', action='store_true', default=False,
                         help='Do not analyze HoWN (homonymy-high-freq) dataset')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='Cache the model responses in Config.RESPONSE_CACHE_FILE.')
+    parser.add_argument('--cache-only', action='store_true',
+                        help='Only serve cached model responses and fail on the first miss. Implies --response-cache.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes, each loading its own model instance. Default: 1')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the words that already have a response in the output files.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream the responses and report time-to-first-token and inter-token latencies.')
 
     args = parser.parse_args()
+    if args.response_cache or args.cache_only:
+        CLIENT.use_cache(DiskCache(Config.RESPONSE_CACHE_FILE), cache_only=args.cache_only)
 
     dataset_name = args.dataset_multi
     dataset_multi = load_dataset(Config.DATASETS[dataset_name], token=Credentials.hf_api_key)
+    revision = dataset_revision(Config.DATASETS[dataset_name])
     contexts = [False] if args.without_context else [True, False]
+    jobs = []
 
     for context in tqdm(contexts, desc="Processing contexts"):
         for lang in tqdm(args.languages, desc="Processing languages", leave=False):
             for prompt_type in tqdm(args.types, desc="Processing prompt types", leave=False):
                 dataset = dataset_multi[lang].to_list()
                 prompt_key = f'{prompt_type}_{'w_context_' if context else ''}{lang}'
-                prompt = PROMPT_TEMPLATES.get(prompt_key)
-                generate_model_response(dataset, prompt,
-                                        OUTPUT_FILE.format(dataset=dataset_name, model=MODEL, prompt_type=prompt_key))
-
-    if args.without_hown:
-        return
-
-    dataset_name = 'homonymy-high-freq'
-    dataset_hown = load_dataset(Config.DATASETS['homonymy-high-freq'], token=Credentials.hf_api_key)
-    dataset = dataset_hown['train'].to_list()
-
-    for context in tqdm(contexts, desc="Processing HoWN contexts"):
-        for prompt_type in tqdm(args.types, desc="Processing HoWN prompt types", leave=False):
-            prompt_key = f'{prompt_type}_{'w_context_' if context else ''}en'
-            prompt = PROMPT_TEMPLATES.get(prompt_key)
-            generate_model_response(dataset, prompt,
-                                    OUTPUT_FILE.format(dataset=dataset_name, model=MODEL, prompt_type=prompt_key))
+                jobs.append(create_job(dataset, prompt_key,
+                                       OUTPUT_FILE.format(dataset=dataset_name, model=MODEL, prompt_type=prompt_key),
+                                       Config.DATASETS[dataset_name], revision, args.resume))
+
+    if not args.without_hown:
+        dataset_name = 'homonymy-high-freq'
+        dataset_hown = load_dataset(Config.DATASETS['homonymy-high-freq'], token=Credentials.hf_api_key)
+        dataset = dataset_hown['train'].to_list()
+        revision = dataset_revision(Config.DATASETS[dataset_name])
+
+        for context in tqdm(contexts, desc="Processing HoWN contexts"):
+            for prompt_type in tqdm(args.types, desc="Processing HoWN prompt types", leave=False):
+                prompt_key = f'{prompt_type}_{'w_context_' if context else ''}en'
+                jobs.append(create_job(dataset, prompt_key,
+                                       OUTPUT_FILE.format(dataset=dataset_name, model=MODEL, prompt_type=prompt_key),
+                                       Config.DATASETS[dataset_name], revision, args.resume))
+
+    if args.workers > 1:
+        cache_file = Config.RESPONSE_CACHE_FILE if args.response_cache or args.cache_only else None
+        LocalGenerationRunner(CLIENT.config, workers=args.workers, cache_file=cache_file, cache_only=args.cache_only,
+                              stream=args.stream).run(jobs)
+    else:
+        for job in tqdm(jobs, desc="Generating responses"):
+            generate_model_response(*job, stream=args.stream)
+
+    if LATENCY_RECORDER:
+        print(LATENCY_RECORDER.report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+Module for the columnar store of the parsed judge results.
+
+All *-parsed-raw.jsonl files below batches/ are consolidated into one Parquet dataset, hive
+partitioned by dataset/model/prompt_type/lang/context. Queries only open the partitions matching
+their filters and only read the requested columns. The mtime and size of every converted file are
+recorded in the store, so a store that is behind the jsonl files can be detected and refreshed.
+
+Build or refresh the store with `python results_store.py`.
+"""
+import argparse
+import os
+import re
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from config import Config
+from reader import JSONLineReader, JSONReader
+
+PARTITIONS = ('dataset', 'model', 'prompt_type', 'lang', 'context')
+PARTITION_SCHEMA = pa.schema([
+    ('dataset', pa.string()),
+    ('model', pa.string()),
+    ('prompt_type', pa.string()),
+    ('lang', pa.string()),
+    ('context', pa.bool_()),
+])
+RESULT_SCHEMA = pa.schema([
+    ('word', pa.string()),
+    ('model_response', pa.string()),
+    ('avg_google_ngrams_frequency', pa.float64()),
+    ('definitions', pa.list_(pa.string())),
+    ('category', pa.string()),
+    ('remark_not_all_listed', pa.bool_()),
+    ('context_clarification_request', pa.bool_()),
+    ('complete_marker', pa.bool_()),
+    ('wordnet_rankings', pa.list_(pa.int64())),
+    ('coarse_synsets_covered', pa.float64()),
+])
+# Fields only present in results parsed with WordNet. They are dropped from records when null,
+# so records match the lines of the jsonl files.
+OPTIONAL_FIELDS = ('wordnet_rankings', 'coarse_synsets_covered')
+
+# Source file -> [mtime_ns, size] of the converted files. The leading underscore keeps pyarrow from
+# reading it as part of the dataset.
+SOURCES_FILE = '_sources.json'
+
+PARSED_FILE_PATTERN = re.compile(
+    r'(?P<prompt_type>normal|simple|child)(?P<context>_w_context)?_(?P<lang>[a-z]{2})-parsed-raw\.jsonl$'
+)
+
+
+def parse_result_path(file_name: str) -> dict | None:
+    """
+    Return the partition values of a batches/{dataset}/{model}/...-parsed-raw.jsonl file.
+
+    :return: Dict with dataset, model, prompt_type, lang and context or None if the file does not
+             follow the naming scheme.
+    """
+    path = Path(file_name)
+    dataset, model = path.parent.parent.name, path.parent.name
+    prefix = f"{dataset}-{model}-output-judge-"
+    if not path.name.startswith(prefix):
+        return None
+    match = PARSED_FILE_PATTERN.fullmatch(path.name[len(prefix):])
+    if match is None:
+        return None
+    return {'dataset': dataset, 'model': model, 'prompt_type': match['prompt_type'], 'lang': match['lang'],
+            'context': match['context'] is not None}
+
+
+class ResultsStore:
+    """Partitioned Parquet dataset of the parsed judge results."""
+
+    def __init__(self, path: str = Config.RESULTS_STORE_DIR):
+        self.path = path
+        self.partitioning = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.path)
+
+    @property
+    def sources_file(self) -> str:
+        return os.path.join(self.path, SOURCES_FILE)
+
+    def sources(self) -> dict[str, list[int]]:
+        """Recorded [mtime_ns, size] of every converted file."""
+        if not os.path.exists(self.sources_file):
+            return {}
+        return JSONReader().read(self.sources_file)
+
+    def partitions(self) -> list[dict]:
+        """Partition values of every converted file, like parse_result_path."""
+        return [parse_result_path(file_name) for file_name in self.sources()]
+
+    @staticmethod
+    def result_files(batches_dir: str = 'batches') -> list[str]:
+        """Parsed result files below batches_dir that follow the naming scheme of the store."""
+        files = sorted(str(path) for path in Path(batches_dir).rglob('*-parsed-raw.jsonl'))
+        return [file_name for file_name in files if parse_result_path(file_name) is not None]
+
+    def stale_files(self, batches_dir: str = 'batches') -> list[str]:
+        """Result files that were added, changed or removed since they were converted."""
+        sources = self.sources()
+        files = self.result_files(batches_dir)
+        changed = [file_name for file_name in files if sources.get(file_name) != file_signature(file_name)]
+        removed = sorted(set(sources) - set(files))
+        return changed + removed
+
+    def build(self, batches_dir: str = 'batches', force: bool = False) -> int:
+        """
+        Convert the parsed result files below batches_dir into the store.
+
+        Partitions of converted files are replaced, partitions of other files are kept.
+
+        :param force: Convert all files, otherwise only the files that changed since their conversion.
+        :return: Number of converted files.
+        """
+        sources = self.sources()
+        converted = 0
+        files = sorted(str(path) for path in Path(batches_dir).rglob('*-parsed-raw.jsonl'))
+        # Partitions of result files that no longer exist are removed.
+        for file_name in sorted(set(sources) - set(files)):
+            self.delete(**parse_result_path(file_name))
+            del sources[file_name]
+            JSONReader().write(self.sources_file, sources, mode='w')
+
+        for file_name in files:
+            partition = parse_result_path(file_name)
+            if partition is None:
+                print(f"Skipping {file_name}, it does not follow the parsed results naming scheme")
+                continue
+            signature = file_signature(file_name)
+            if not force and sources.get(file_name) == signature:
+                continue
+            self.write(JSONLineReader(on_error='warn').iter(file_name), **partition)
+            sources[file_name] = signature
+            JSONReader().write(self.sources_file, sources, mode='w')
+            converted += 1
+        return converted
+
+    def write(self, records, **partition):
+        """Replace the partition with the given records."""
+        table = pa.Table.from_pylist(list(records), schema=RESULT_SCHEMA)
+        for name in PARTITIONS:
+            table = table.append_column(PARTITION_SCHEMA.field(name),
+                                        pa.array([partition[name]] * len(table), PARTITION_SCHEMA.field(name).type))
+        ds.write_dataset(table, self.path, format='parquet', partitioning=self.partitioning,
+                         existing_data_behavior='delete_matching', use_threads=False)
+
+    def delete(self, **partition):
+        """Remove a partition."""
+        expression = None
+        for name in PARTITIONS:
+            condition = ds.field(name) == partition[name]
+            expression = condition if expression is None else expression & condition
+        directory, _ = self.partitioning.format(expression)
+        shutil.rmtree(os.path.join(self.path, directory), ignore_errors=True)
+
+    def read(self, columns: list[str] | None = None, **filters) -> pa.Table:
+        """
+        Read the results matching all filters.
+
+        :param columns: Columns to read, result and partition columns, all if None.
+        :param filters: Column values to keep, a list keeps any of its values, e.g.
+                        dataset='mcl-wic', lang=['en', 'fr'].
+        :return: The matching rows.
+        """
+        expression = None
+        for name, value in filters.items():
+            condition = ds.field(name).isin(value) if isinstance(value, (list, tuple, set)) else ds.field(name) == value
+            expression = condition if expression is None else expression & condition
+        dataset = ds.dataset(self.path, format='parquet', partitioning=self.partitioning)
+        return dataset.to_table(columns=columns, filter=expression)
+
+    def read_records(self, columns: list[str] | None = None, **filters) -> list[dict]:
+        """Read the results matching all filters as dicts like the lines of the parsed jsonl files."""
+        records = self.read(columns, **filters).to_pylist()
+        for record in records:
+            for name in OPTIONAL_FIELDS:
+                if name in record and record[name] is None:
+                    del record[name]
+        return records
+
+
+def file_signature(file_name: str) -> list[int]:
+    stat = os.stat(file_name)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the parsed judge results into the results store.")
+    parser.add_argument('--batches-dir', type=str, default='batches')
+    parser.add_argument('--store', type=str, default=Config.RESULTS_STORE_DIR)
+    parser.add_argument('--force', action='store_true', help='Convert all files, also the unchanged ones.')
+    args = parser.parse_args()
+
+    converted = ResultsStore(args.store).build(args.batches_dir, force=args.force)
+    print(f"Converted {converted} files into {args.store}")
+
+
+if __name__ == "__main__":
+    main()
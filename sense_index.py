@@ -0,0 +1,162 @@
+"""
+Module for the approximate nearest neighbour index over all WordNet noun glosses.
+
+Unlike the gloss matrix, which only holds the senses of the dataset words, the sense index covers every
+noun synset, so definitions can be matched to senses listed under another lemma, e.g. a multiword or
+derived form. It is an inverted file index: the normalized gloss embeddings are clustered with
+spherical k-means and a query is only compared to the glosses of its n_probe closest clusters.
+
+Build it once per embedding model with `python sense_index.py`.
+"""
+import argparse
+import os
+
+import numpy as np
+
+from config import Config
+from gloss_matrix import model_slug, normalize
+from reader import JSONReader
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 42) -> np.ndarray:
+    """Cluster normalized vectors by cosine similarity and return the normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            # Empty clusters keep their centroid.
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+class SenseIndex:
+    """
+    Inverted file index of normalized gloss embeddings.
+
+    :param vectors: Gloss embeddings sorted by cluster.
+    :param centroids: Normalized cluster centroids.
+    :param offsets: Rows offsets[c]:offsets[c + 1] of vectors belong to cluster c.
+    :param synset_names: Synset name of each row of vectors.
+    """
+
+    def __init__(self, vectors: np.ndarray, centroids: np.ndarray, offsets: np.ndarray, synset_names: list[str]):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.synset_names = synset_names
+
+    @staticmethod
+    def paths(model_name: str, directory: str = Config.SENSE_INDEX_DIR) -> dict[str, str]:
+        base = os.path.join(directory, model_slug(model_name))
+        return {'vectors': f"{base}.vectors.npy", 'centroids': f"{base}.centroids.npy",
+                'offsets': f"{base}.offsets.npy", 'index': f"{base}.index.json"}
+
+    @classmethod
+    def open(cls, model_name: str, directory: str = Config.SENSE_INDEX_DIR) -> 'SenseIndex | None':
+        """Open the index of an embedding model, the vectors memory-mapped. None if it was not built."""
+        paths = cls.paths(model_name, directory)
+        if not all(os.path.exists(path) for path in paths.values()):
+            return None
+        return cls(np.load(paths['vectors'], mmap_mode='r'), np.load(paths['centroids']), np.load(paths['offsets']),
+                   JSONReader().read(paths['index'])['synset_names'])
+
+    @classmethod
+    def build(cls, synset_names: list[str], embeddings: np.ndarray, model_name: str,
+              directory: str = Config.SENSE_INDEX_DIR, n_clusters: int | None = None,
+              dtype: str = 'float32') -> 'SenseIndex':
+        """
+        Cluster and save the gloss embeddings.
+
+        :param synset_names: Synset name of each embedding.
+        :param embeddings: Gloss embeddings.
+        :param n_clusters: Number of clusters, 4 * sqrt(number of glosses) if None.
+        :param dtype: float32 or float16 for the stored vectors.
+        """
+        vectors = normalize(embeddings)
+        n_clusters = n_clusters or max(1, int(4 * np.sqrt(len(vectors))))
+        centroids = spherical_kmeans(vectors, n_clusters)
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignments, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_clusters))])
+
+        paths = cls.paths(model_name, directory)
+        os.makedirs(directory, exist_ok=True)
+        np.save(paths['vectors'], vectors[order].astype(dtype))
+        np.save(paths['centroids'], centroids)
+        np.save(paths['offsets'], offsets)
+        JSONReader().write(paths['index'], {'model': model_name, 'dtype': dtype,
+                                            'synset_names': [synset_names[i] for i in order]}, mode='w')
+        return cls.open(model_name, directory)
+
+    def __len__(self) -> int:
+        return len(self.synset_names)
+
+    def top_k_senses(self, definition_vectors: np.ndarray, k: int = 5,
+                     n_probe: int = 16) -> list[list[tuple[str, float]]]:
+        """
+        Find the senses with the most similar glosses for a batch of definitions.
+
+        :param definition_vectors: Embeddings of the definitions, one row each.
+        :param k: Number of senses per definition.
+        :param n_probe: Number of clusters searched per definition, more clusters increase recall and time.
+        :return: Per definition the synset names and cosine similarities of the top k senses, best first.
+        """
+        queries = normalize(definition_vectors)
+        if not len(queries):
+            return []
+        n_probe = min(n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+
+        # Clusters are searched one at a time for all definitions probing them, keeping a running top k.
+        best_similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1)
+        for cluster in np.unique(probes):
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == end:
+                continue
+            query_ids = np.flatnonzero((probes == cluster).any(axis=1))
+            similarities = np.concatenate([
+                best_similarities[query_ids],
+                queries[query_ids] @ np.asarray(self.vectors[start:end], dtype=np.float32).T
+            ], axis=1)
+            rows = np.concatenate([best_rows[query_ids], np.broadcast_to(np.arange(start, end),
+                                                                         (len(query_ids), end - start))], axis=1)
+            top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+            best_similarities[query_ids] = np.take_along_axis(similarities, top, axis=1)
+            best_rows[query_ids] = np.take_along_axis(rows, top, axis=1)
+
+        order = np.argsort(-best_similarities, axis=1)
+        best_similarities = np.take_along_axis(best_similarities, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [[(self.synset_names[row], float(similarity))
+                 for row, similarity in zip(rows, similarities) if row != -1]
+                for rows, similarities in zip(best_rows, best_similarities)]
+
+
+def main():
+    from nltk.corpus import wordnet as wn
+
+    from evaluation_parser import EvaluationParser
+
+    parser = argparse.ArgumentParser(description="Build the sense index over all WordNet noun glosses.")
+    parser.add_argument('--n-clusters', type=int, default=None)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--directory', default=Config.SENSE_INDEX_DIR)
+    parser.add_argument('--embedding-backend', default=Config.EMBEDDING_BACKEND)
+    args = parser.parse_args()
+
+    evaluation_parser = EvaluationParser(args.embedding_backend)
+    synsets = list(wn.all_synsets(pos='n'))
+    embeddings = evaluation_parser.gloss_embeddings(synsets)
+    names = [synset.name() for synset in synsets]
+    index = SenseIndex.build(names, np.stack([embeddings[name] for name in names]),
+                             evaluation_parser.embedding_model, args.directory, args.n_clusters, args.dtype)
+    print(f"Built sense index of {len(index)} glosses in {len(index.centroids)} clusters in {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Run BatchOrchestrator against the fake batch server.
+
+Usage: python -m pytest tests/test_batch_orchestrator.py
+"""
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from batch_orchestrator import BatchJobSpec, BatchOrchestrator
+from config import LLMConfig
+from fake_batch_server import start_fake_batch_server
+from llm_client import OpenAIClient
+from reader import JSONLineReader
+
+N_TASKS = 50
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptedOrchestrator(BatchOrchestrator):
+    """Stops the run after the first collected batch, like a crash between two polls."""
+
+    def _collect(self, batch):
+        super()._collect(batch)
+        raise Interrupted()
+
+
+@pytest.fixture
+def fake_server(request):
+    server, base_url = start_fake_batch_server(polls_to_complete=1, **getattr(request, 'param', {}))
+    yield server.RequestHandlerClass.backend, base_url
+    server.shutdown()
+
+
+def make_spec(tmp_path, base_url: str, **kwargs) -> BatchJobSpec:
+    input_file = str(tmp_path / 'input.jsonl')
+    JSONLineReader().write(input_file, [
+        {'custom_id': f'task-{idx}', 'method': 'POST', 'url': '/v1/chat/completions',
+         'body': {'model': 'fake', 'messages': [{'role': 'user', 'content': f'word {idx}'}]}}
+        for idx in range(N_TASKS)
+    ], mode='w')
+    return BatchJobSpec(name='test', input_file=input_file, output_file=str(tmp_path / 'output.jsonl'),
+                        base_url=base_url, max_requests=10, poll_interval=0.01, max_poll_interval=0.05, **kwargs)
+
+
+def make_client(base_url: str) -> OpenAIClient:
+    return OpenAIClient(LLMConfig(model='fake', client_class='OpenAIClient', base_url=base_url, api_key='test'))
+
+
+def output_ids(spec: BatchJobSpec) -> Counter:
+    return Counter(line['custom_id'] for line in JSONLineReader().read(spec.output_file))
+
+
+@pytest.mark.parametrize('fake_server', [{'failure_rate': 0.3, 'expire_rate': 0.5}], indirect=True)
+def test_resubmits_failed_and_expired_requests(tmp_path, fake_server):
+    backend, base_url = fake_server
+    spec = make_spec(tmp_path, base_url)
+
+    summary = BatchOrchestrator(spec, make_client(base_url)).run()
+
+    assert summary['succeeded'] == N_TASKS and summary['failed'] == 0
+    assert summary['attempts'] > 1
+    assert any(batch['status'] == 'expired' for batch in backend.batches.values())
+    assert output_ids(spec) == Counter({f'task-{idx}': 1 for idx in range(N_TASKS)})
+    assert not os.path.exists(spec.state_file) and not os.path.exists(spec.shard_dir)
+
+
+def test_resume_picks_up_batches_in_flight(tmp_path, fake_server):
+    backend, base_url = fake_server
+    spec = make_spec(tmp_path, base_url)
+
+    with pytest.raises(Interrupted):
+        InterruptedOrchestrator(spec, make_client(base_url)).run()
+    assert os.path.exists(spec.state_file)
+    submitted = len(backend.batches)
+
+    summary = BatchOrchestrator(spec, make_client(base_url)).run()
+
+    assert summary['succeeded'] == N_TASKS
+    assert len(backend.batches) == submitted
+    assert output_ids(spec) == Counter({f'task-{idx}': 1 for idx in range(N_TASKS)})
+
+
+@pytest.mark.parametrize('fake_server', [{'failure_rate': 0.5}], indirect=True)
+def test_errors_survive_resume(tmp_path, fake_server):
+    backend, base_url = fake_server
+    spec = make_spec(tmp_path, base_url, max_attempts=1)
+
+    with pytest.raises(Interrupted):
+        InterruptedOrchestrator(spec, make_client(base_url)).run()
+    summary = BatchOrchestrator(spec, make_client(base_url)).run()
+
+    errors = JSONLineReader().read(spec.errors_file)
+    assert summary['failed'] == len(errors) > 0
+    assert all(error['error'] is not None for error in errors)
+    assert {error['custom_id'] for error in errors}.isdisjoint(output_ids(spec))
@@ -0,0 +1,78 @@
+"""
+Check that a failed sub-judgement of LLMJudge keeps the result of the other one.
+
+Usage: python -m pytest tests/test_llm_judge.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from LLMJudge import LLMJudge, SubJudgementError
+from evaluation import HomonymEvaluator
+
+DEFINITIONS = {'definitions': ['A financial institution', 'The side of a river'], 'category': 'Multiple',
+               'explanation': 'Two senses.'}
+MARKER = {'remark_not_all_listed': False, 'context_clarification_request': True, 'explanation': 'Asks.'}
+
+
+class FlakyJudge(LLMJudge):
+    """Sub-judgements fail for the judge types in failures until their failure count is used up."""
+
+    def __init__(self, failures: dict[str, int]):
+        super().__init__(max_workers=2)
+        self.failures = failures
+        self.calls = []
+
+    def sub_judge_response(self, query: str, model_response: str, judge_type: str, response_style: str) -> dict:
+        self.calls.append(judge_type)
+        if self.failures.get(judge_type, 0) > 0:
+            self.failures[judge_type] -= 1
+            raise RuntimeError(f"{judge_type} unavailable")
+        return MARKER if judge_type == 'marker' else DEFINITIONS
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+
+
+def test_failed_sub_judgement_keeps_the_other_result():
+    judge = FlakyJudge({'marker': 1})
+
+    with pytest.raises(SubJudgementError) as error:
+        judge.judge_response('What is "bank"?', 'A bank is ...', 'normal')
+
+    assert error.value.results == {'definitions': DEFINITIONS}
+    assert set(error.value.errors) == {'marker'}
+
+    judgment = judge.judge_response('What is "bank"?', 'A bank is ...', 'normal', error.value.results)
+    assert judgment['definitions'] == DEFINITIONS['definitions']
+    assert judgment['context_clarification_request'] is True
+    assert sorted(judge.calls) == ['definitions', 'marker', 'marker']
+
+
+def test_evaluator_retries_only_the_failed_sub_judgement():
+    evaluator = HomonymEvaluator.__new__(HomonymEvaluator)
+    evaluator.judge_client = FlakyJudge({'definitions': 2})
+    evaluator.response_style = 'normal'
+    evaluator.judge_attempts = 3
+
+    judgment = evaluator.judge('What is "bank"?', 'A bank is ...')
+
+    assert judgment['category'] == 'Multiple'
+    assert evaluator.judge_client.calls.count('marker') == 1
+    assert evaluator.judge_client.calls.count('definitions') == 3
+
+
+def test_evaluator_raises_after_the_last_attempt():
+    evaluator = HomonymEvaluator.__new__(HomonymEvaluator)
+    evaluator.judge_client = FlakyJudge({'definitions': 5})
+    evaluator.response_style = 'normal'
+    evaluator.judge_attempts = 2
+
+    with pytest.raises(SubJudgementError) as error:
+        evaluator.judge('What is "bank"?', 'A bank is ...')
+    assert error.value.results == {'marker': MARKER}
@@ -0,0 +1,72 @@
+"""
+Check that Analysis reads the same results from the results store as from the parsed jsonl files.
+
+Usage: python -m pytest tests/test_results_store.py
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from analysis import Analysis
+from reader import JSONLineReader
+from results_store import ResultsStore
+
+MODELS = {'Model A': 'model-a', 'Model B': 'model-b'}
+WORDS = ['bank', 'bat', 'bark']
+
+
+def write_results(model_id: str, type_: str, context: str, words: list[str]):
+    file_name = Analysis.HOWN_FILE.format(model=model_id, type=type_, context=context)
+    Path(file_name).parent.mkdir(parents=True, exist_ok=True)
+    JSONLineReader().write(file_name, [
+        {'word': word, 'model_response': f'{word} by {model_id}', 'category': 'Multiple', 'complete_marker': True,
+         'definitions': [f'{word} 1', f'{word} 2'], 'avg_google_ngrams_frequency': 0.5}
+        for word in words
+    ], mode='w')
+
+
+@pytest.fixture
+def analyses(tmp_path, monkeypatch):
+    """Analyses reading from the jsonl files and from a store, the DPO-like model-b has no context results."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Analysis, 'MODELS', MODELS)
+    for type_ in Analysis.TYPES:
+        write_results('model-a', type_, '', WORDS)
+        write_results('model-b', type_, '', WORDS[1:])
+        write_results('model-a', type_, '_w_context', WORDS)
+
+    store = ResultsStore(str(tmp_path / 'store'))
+    store.build('batches')
+    jsonl_analysis = Analysis(ResultsStore(str(tmp_path / 'no-store')))
+    store_analysis = Analysis(store)
+    assert not jsonl_analysis.use_store and store_analysis.use_store
+    return jsonl_analysis, store_analysis
+
+
+def sort_results(stats: dict) -> dict:
+    return {type_: {model: sorted(results, key=lambda result: result['word']) for model, results in models.items()}
+            for type_, models in stats.items()}
+
+
+def test_store_matches_jsonl(analyses):
+    jsonl_analysis, store_analysis = analyses
+
+    results = sort_results(store_analysis.get_hown_results())
+
+    assert results == sort_results(jsonl_analysis.get_hown_results())
+    assert [result['word'] for result in results['normal']['Model A']] == ['bark', 'bat']
+
+
+def test_missing_context_results_raise_like_jsonl(analyses):
+    jsonl_analysis, store_analysis = analyses
+
+    with pytest.raises(FileNotFoundError):
+        jsonl_analysis.get_hown_results(w_context=True)
+    with pytest.raises(FileNotFoundError, match='model-b/normal/en'):
+        store_analysis.get_hown_results(w_context=True)
+    with pytest.raises(FileNotFoundError):
+        store_analysis.read_hown_model_results('model-b', 'normal', w_context=True)
+    assert len(store_analysis.read_hown_model_results('model-a', 'normal', w_context=True)) == len(WORDS)
@@ -6,6 +6,7 @@ from LLMJudge import JUDGE_PROMPT_TEMPLATE, MARKER_SYSTEM_PROMPT, DEFINITION_SYS
     DEFINITION_SCHEMA, MARKER_SCHEMA, CHILD_DEFINITION_SYSTEM_PROMPT
 from config import LLMConfig, Config, Credentials, PROJECT_DIR
 from evaluation import PROMPT_TEMPLATES
+from batch_orchestrator import BatchJobSpec, BatchOrchestrator
 from llm_client import OpenAIClient
 from reader import JSONLineReader
 
@@ -15,6 +16,7 @@ LANGUAGES = ['en', 'fr', 'ar', 'ru', 'zh']
 CONTEXTS = [False]
 MODEL = 'dpo-llama-v3p1-8b-instruct'
 OUTPUT_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{MODEL}/{DATASET}-{MODEL}-input-judge.jsonl'
+RAW_JUDGES_FILE = f'{PROJECT_DIR}/batches/{DATASET}/{MODEL}/{DATASET}-{MODEL}-raw-output-judge.jsonl'
 
 client = OpenAIClient(LLMConfig(
             model="gpt-4o-mini-2024-07-18", #"gpt-4.1-mini-2025-04-14",
@@ -74,5 +76,6 @@ for sub_judgement in ['marker', 'definition']:
                     }
                     tasks.append(task)
 
-JSONLineReader().write(OUTPUT_FILE, tasks)
-client.create_batch_job(OUTPUT_FILE, endpoint='/v1/responses')
+JSONLineReader().write(OUTPUT_FILE, tasks, mode='w')
+BatchOrchestrator(BatchJobSpec(name=f'judge-{DATASET}-{MODEL}', input_file=OUTPUT_FILE, output_file=RAW_JUDGES_FILE,
+                               endpoint='/v1/responses'), client).run()
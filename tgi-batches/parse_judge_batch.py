@@ -21,6 +21,7 @@ judge_outputs = JSONLineReader().read(RAW_JUDGES_FILE)
 
 datadict = load_dataset(Config.DATASETS[DATASET], token=Credentials.hf_api_key)
 
+parse_files = []
 for lang in tqdm(LANGUAGES):
     if DATASET == 'homonymy-high-freq':
         dataset = datadict['train'].to_list()
@@ -85,5 +86,6 @@ for lang in tqdm(LANGUAGES):
             #
             # JSONLineReader().write(OUTPUT_FILE, intermediate_results)
 
-            add_wordnet = DATASET == 'homonymy-high-freq'
-            EvaluationParser().parse_evaluation(OUTPUT_FILE, PARSED_OUTPUT_FILE, add_wordnet=add_wordnet)
+            parse_files.append((OUTPUT_FILE, PARSED_OUTPUT_FILE))
+
+EvaluationParser().parse_evaluations(parse_files, add_wordnet=DATASET == 'homonymy-high-freq')
@@ -85,6 +85,9 @@ class JSONLineReader(Reader):
 # Load your fine-tuned LoRA model
 model_path = "./dpo-llama3-merged"
 tokenizer = AutoTokenizer.from_pretrained(model_path)
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+tokenizer.padding_side = 'left'
 
 # Load model with float16 precision
 model = AutoModelForCausalLM.from_pretrained(
@@ -102,23 +105,38 @@ pipe = pipeline(
     do_sample=False,
 )
 
-def define_term(prompt: str):
-    messages = [
-        {"role": "user", "content": prompt}
+BATCH_SIZE = 16
+CHUNK_SIZE = 128  # prompts per define_terms call, results are written after each chunk
+
+def define_terms(prompts: list[str]) -> list[str]:
+    """Generate the prompts in batches, sorted by token length so each batch needs little padding."""
+    chat_prompts = [
+        tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True)
+        for prompt in prompts
     ]
-    prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-    return pipe(prompt)[0]["generated_text"]
+    order = sorted(range(len(chat_prompts)), key=lambda idx: len(tokenizer(chat_prompts[idx])['input_ids']))
+
+    responses = [None] * len(chat_prompts)
+    for start in range(0, len(order), BATCH_SIZE):
+        batch = order[start:start + BATCH_SIZE]
+        outputs = pipe([chat_prompts[idx] for idx in batch], batch_size=len(batch))
+        for idx, output in zip(batch, outputs):
+            responses[idx] = output[0]["generated_text"]
+    return responses
 
 def generate_model_response(homonyms: list[dict], prompt_template: str, output_file: str):
-    for entry in homonyms:
-        word = entry["word"]
-        prompt = prompt_template.format(word=word)
-        model_response = define_term(prompt)
-        result = {
-            "word": word,
-            "model_response": model_response,
-        }
-        JSONLineReader().write(output_file, [result])
+    for start in range(0, len(homonyms), CHUNK_SIZE):
+        chunk = homonyms[start:start + CHUNK_SIZE]
+        prompts = [prompt_template.format(word=entry["word"]) for entry in chunk]
+        model_responses = define_terms(prompts)
+        results = [
+            {
+                "word": entry["word"],
+                "model_response": model_response,
+            }
+            for entry, model_response in zip(chunk, model_responses)
+        ]
+        JSONLineReader().write(output_file, results)
 
 def evaluate_dataset(dataset: list[dict], lang: str, prompt_type: str, context: bool, dataset_name: str):
     suffix = f"w_context_{lang}" if context else lang
@@ -2,10 +2,13 @@ import argparse
 from datasets import load_dataset
 from tqdm import tqdm
 
+from cache import DiskCache
+from checkpoint import RunManifest, dataset_revision, resume_offset
 from config import Config, Credentials, LLMConfig
 from evaluation import PROMPT_TEMPLATES
+from latency_metrics import LATENCY_RECORDER
 from llm_client import OpenAIClient
-from reader import JSONLineReader
+from reader import JSONLineAppender
 
 TYPES = ['simple', 'child', 'normal']
 LANGUAGES = ['en', 'fr', 'ru', 'ar', 'zh']
@@ -21,18 +24,28 @@ CLIENT = OpenAIClient(LLMConfig(
     api_key=Credentials.fw_api_key,
 ))
 
-def generate_model_response(homonyms: list[dict], prompt_template: str, output_file: str):
-    for entry in homonyms:
-        word = entry["word"]
-        prompt = prompt_template.format(word=word)
-        model_response = CLIENT.define_term(prompt)
-        result = {
-            "word": word,
-            "model_response": model_response,
-        }
-        JSONLineReader().write(output_file, [result])
-
-def evaluate_dataset(dataset: list[dict], lang: str, prompt_type: str, context: bool, dataset_name: str):
+def generate_model_response(homonyms: list[dict], prompt_template: str, output_file: str,
+                            manifest: RunManifest | None = None, resume: bool = False, stream: bool = False):
+    start = resume_offset(homonyms, output_file) if resume else 0
+    if manifest is not None:
+        manifest.completed, manifest.total = start, len(homonyms)
+
+    with JSONLineAppender(output_file) as appender:
+        for entry in homonyms[start:]:
+            word = entry["word"]
+            prompt = prompt_template.format(word=word)
+            model_response = ''.join(CLIENT.stream_term(prompt)).strip() if stream else CLIENT.define_term(prompt)
+            result = {
+                "word": word,
+                "model_response": model_response,
+            }
+            appender.write(result)
+            if manifest is not None:
+                manifest.completed += 1
+                manifest.save(output_file)
+
+def evaluate_dataset(dataset: list[dict], lang: str, prompt_type: str, context: bool, dataset_name: str,
+                     resume: bool = False, revision: str | None = None, stream: bool = False):
     suffix = f"w_context_{lang}" if context else lang
     prompt_key = f"{prompt_type}_{suffix}"
     prompt = PROMPT_TEMPLATES.get(prompt_key)
@@ -42,7 +55,9 @@ def evaluate_dataset(dataset: list[dict], lang: str, prompt_type: str, context:
         return
 
     output_path = OUTPUT_FILE.format(dataset=dataset_name, model=MODEL, prompt_type=prompt_key)
-    generate_model_response(dataset, prompt, output_path)
+    manifest = RunManifest(model=CLIENT.model, prompt_key=prompt_key, dataset=Config.DATASETS[dataset_name],
+                           dataset_revision=revision)
+    generate_model_response(dataset, prompt, output_path, manifest=manifest, resume=resume, stream=stream)
 
 def main():
     parser = argparse.ArgumentParser(description="Evaluate model prompts over datasets.")
@@ -58,30 +73,47 @@ def main():
                         help='Evaluate only without context.')
     parser.add_argument('--without-hown', action='store_true',
                         help='Skip HoWN (homonymy-high-freq) evaluation.')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='Cache the model responses in Config.RESPONSE_CACHE_FILE.')
+    parser.add_argument('--cache-only', action='store_true',
+                        help='Only serve cached model responses and fail on the first miss. Implies --response-cache.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the words that already have a response in the output files.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Stream the responses and report time-to-first-token and inter-token latencies.')
 
     args = parser.parse_args()
+    if args.response_cache or args.cache_only:
+        CLIENT.use_cache(DiskCache(Config.RESPONSE_CACHE_FILE), cache_only=args.cache_only)
     contexts = [False] if args.without_context else [True, False]
 
     # Evaluate multilingual dataset
     if not args.without_multilingual:
         dataset_name = args.dataset_multi
         dataset_multi = load_dataset(Config.DATASETS[dataset_name], token=Credentials.hf_api_key)
+        revision = dataset_revision(Config.DATASETS[dataset_name])
 
         for context in tqdm(contexts, desc="Contexts"):
             for lang in tqdm(args.languages, desc="Languages", leave=False):
                 dataset = dataset_multi[lang].to_list()
                 for prompt_type in tqdm(args.types, desc="Prompt Types", leave=False):
-                    evaluate_dataset(dataset, lang, prompt_type, context, dataset_name)
+                    evaluate_dataset(dataset, lang, prompt_type, context, dataset_name,
+                                     resume=args.resume, revision=revision, stream=args.stream)
 
     # Evaluate HoWN
     if not args.without_hown:
         dataset_name = 'homonymy-high-freq'
         dataset_hown = load_dataset(Config.DATASETS[dataset_name], token=Credentials.hf_api_key)
         dataset = dataset_hown['train'].to_list()
+        revision = dataset_revision(Config.DATASETS[dataset_name])
 
         for context in tqdm(contexts, desc="HoWN Contexts"):
             for prompt_type in tqdm(args.types, desc="HoWN Prompt Types", leave=False):
-                evaluate_dataset(dataset, lang='en', prompt_type=prompt_type, context=context, dataset_name=dataset_name)
+                evaluate_dataset(dataset, lang='en', prompt_type=prompt_type, context=context, dataset_name=dataset_name,
+                                 resume=args.resume, revision=revision, stream=args.stream)
+
+    if LATENCY_RECORDER:
+        print(LATENCY_RECORDER.report())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file